@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import os, sys, json, time, shutil, argparse, tempfile, resource, subprocess, logging
+import cv2
+import pandas as pd
+
+import consts, cv_helpers, recognizer, mp_helpers, cv2detection_try
+
+# functions timed in every stage, (module or dict, attribute)
+STAGES = {
+    "preprocess": [(cv_helpers, "preprocess_image"), (cv_helpers, "preprocess_roi")],
+    "contours": [(cv_helpers, "find_countours"), (cv_helpers, "get_boxes")],
+    "east": [(cv2detection_try, "detect_text"), (cv2detection_try, "decode_predictions"), 
+        (cv2detection_try, "non_max_suppression")],
+    "detection": [(recognizer, "detect_keys"), (recognizer, "detect_values"), (recognizer, "match_keys"),
+        (recognizer, "match_key"), (recognizer, "map_value")]
+}
+
+def add_timing(timings, stage, seconds):
+    count, total = timings.get(stage, (0, 0.))
+    timings[stage] = (count + 1, total + seconds)
+
+def timed(timings, stage, func):
+    """Wrap function to add its run time to the stage
+
+    Arguments:
+        timings {dict} -- stage to (number of calls, seconds)
+        stage {str} -- stage name
+        func {function} -- function to wrap
+
+    Returns:
+        function -- wrapped function
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add_timing(timings, stage, time.perf_counter() - start)
+    return wrapper
+
+def timed_iter(timings, stage, func):
+    """Wrap generator function to add time spent producing every item to the stage"""
+    def wrapper(*args, **kwargs):
+        it = func(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                add_timing(timings, stage, time.perf_counter() - start)
+            yield item
+    return wrapper
+
+class TimedEngine:
+    """OCR engine adding run time of every call to the "ocr" stage"""
+    def __init__(self, engine, timings):
+        self.engine = engine
+        self.timings = timings
+
+    def image_to_string(self, *args, **kwargs):
+        return timed(self.timings, "ocr", self.engine.image_to_string)(*args, **kwargs)
+
+    def image_to_data(self, *args, **kwargs):
+        return timed(self.timings, "ocr", self.engine.image_to_data)(*args, **kwargs)
+
+def instrument(timings, similarity):
+    """Replace functions of the pipeline with timed ones
+
+    Arguments:
+        timings {dict} -- stage to (number of calls, seconds)
+        similarity {str} -- key of cv_helpers.FRAME_SIMILARITY used for extraction
+
+    Returns:
+        list -- (target, attribute, original) to restore
+    """
+    patched = []
+    def patch(target, attr, wrapper):
+        if isinstance(target, dict):
+            patched.append((target, attr, target[attr]))
+            target[attr] = wrapper(target[attr])
+        else:
+            patched.append((target, attr, getattr(target, attr)))
+            setattr(target, attr, wrapper(getattr(target, attr)))
+    for stage, funcs in STAGES.items():
+        for target, attr in funcs:
+            patch(target, attr, lambda f, stage=stage: timed(timings, stage, f))
+    method = cv_helpers.FRAME_SIMILARITY[similarity]
+    patch(method, "prepare", lambda f: timed(timings, "dedup", f))
+    patch(method, "compare", lambda f: timed(timings, "dedup", f))
+    patch(cv_helpers, "read_frames_sequential", lambda f: timed_iter(timings, "decode", f))
+    patch(cv2, "imwrite", lambda f: timed(timings, "write_frames", f))
+    patch(cv_helpers, "get_ocr_engine", lambda f: lambda *args: TimedEngine(f(*args), timings))
+    return patched
+
+def restore(patched):
+    for target, attr, original in reversed(patched):
+        if isinstance(target, dict):
+            target[attr] = original
+        else:
+            setattr(target, attr, original)
+
+def new_data():
+    data = {}
+    for k in consts.EXPECTED_KEYS:
+        data[k] = []
+    data["file"] = []
+    return data
+
+def append_result(res, data):
+    for k in res:
+        data[k].append(res[k])
+
+def save_data(data, output_csv):
+    df = pd.DataFrame(data=data)
+    df = df.groupby("timestamp").first().sort_values(by=["timestamp"]).reset_index()
+    df.to_csv(output_csv)
+
+def list_frames(folder, limit=None):
+    frames_fn = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".png"))
+    return frames_fn if limit is None else frames_fn[:limit]
+
+def profile_extraction(input_path, output_folder, tolerance=None, similarity=consts.DEFAULT_FRAME_SIMILARITY):
+    """Extract frames in this process with one segment, as mp_helpers.extract_video does with one worker
+
+    Returns:
+        (int, int, float) -- (number of read frames, number of kept frames, seconds)
+    """
+    start = time.perf_counter()
+    _, frames, middle_frame = mp_helpers.sample_video_frames(input_path)
+    mp_helpers.init_extract_worker(input_path, output_folder, frames, middle_frame, tolerance, False, similarity)
+    _, kept, _, _ = mp_helpers.extract_segment_job((0, len(frames)))
+    return len(frames), len(kept), time.perf_counter() - start
+
+def profile_recognition(frames_fn, padding=0, scaling_factor=1, options=None):
+    """Recognize frames in this process with settings of a worker
+
+    Returns:
+        (dict, float) -- (data for CSV, seconds)
+    """
+    data = new_data()
+    start = time.perf_counter()
+    mp_helpers.init_worker(padding, scaling_factor, False, options)
+    for f in frames_fn:
+        _, result = mp_helpers.recognise_image(f)
+        append_result(result, data)
+    return data, time.perf_counter() - start
+
+def check_parity(output_csv, reference_csv, complete=True):
+    """Compare recognized values with the reference CSV, rows are matched by timestamp
+
+    Arguments:
+        output_csv {str} -- path to recognized CSV
+        reference_csv {str} -- path to expected CSV
+
+    Keyword Arguments:
+        complete {bool} -- all frames are recognized, so missing and extra rows are differences (default: {True})
+
+    Returns:
+        dict -- numbers of rows and differences, "ok" is True if all values are the same
+    """
+    keys = [k for k in consts.EXPECTED_KEYS if k != "timestamp"]
+    df = pd.read_csv(output_csv).set_index("timestamp")
+    ref = pd.read_csv(reference_csv).set_index("timestamp")
+    common = ref.index.intersection(df.index)
+    mismatched = {}
+    for k in keys:
+        if k not in df.columns:
+            mismatched[k] = len(common)
+            continue
+        a = df.loc[common, k]
+        b = ref.loc[common, k]
+        n = int((~((a == b) | (a.isnull() & b.isnull()))).sum())
+        if n > 0:
+            mismatched[k] = n
+    report = {
+        "reference_rows": len(ref),
+        "rows": len(df),
+        "missing": len(ref.index.difference(df.index)),
+        "extra": len(df.index.difference(ref.index)),
+        "mismatched": mismatched
+    }
+    report["ok"] = len(mismatched) == 0 and (not complete or (report["missing"] == 0 and report["extra"] == 0))
+    return report
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def peak_rss():
+    # kilobytes on Linux
+    return {
+        "self_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Measure stage timings, throughput and output parity on the sample recording")
+    ap.add_argument("-i", "--input", type=str, default="sample/video.mp4", help="Path to video file")
+    ap.add_argument("-f", "--frames", type=str, default="sample/video", help="Folder with extracted frames to recognize")
+    ap.add_argument("-c", "--reference-csv", type=str, default="sample/video.csv", help="Expected output, empty to skip the check")
+    ap.add_argument("-n", "--n-proc", type=str, default="1", help="Comma separated numbers of processes for parallel runs, 0 to skip them")
+    ap.add_argument("-l", "--limit", type=int, default=None, help="Number of frames to recognize")
+    ap.add_argument("-p", "--padding", type=int, default=20, help="Fixed padding")
+    ap.add_argument("-s", "--scaling-factors", type=str, default="5,4,3,2", help="Scaling factor to resize for Tesseract")
+    ap.add_argument("-t", "--video-tolerance", type=float, default=None, help="Tolerance to skip similar frames, default depends on --video-similarity")
+    ap.add_argument("--video-similarity", type=str, default=consts.DEFAULT_FRAME_SIMILARITY, choices=list(cv_helpers.FRAME_SIMILARITY),
+        help="Way to compare video frames")
+    ap.add_argument("-b", "--batch-rois", action='store_true', help="Recognize all ROIs of a frame with one Tesseract call")
+    ap.add_argument("-L", "--reuse-layout", action='store_true', help="Reuse text block boxes of previous frames")
+    ap.add_argument("-K", "--reuse-keys", action='store_true', help="Recognize only values once keys are learned")
+    ap.add_argument("-T", "--reuse-texts", action='store_true', help="Reuse recognized text of unchanged ROIs")
+    ap.add_argument("-A", "--adaptive-scaling", action='store_true', help="Try the most successful scaling factor first and retry only failed cells")
+    ap.add_argument("-X", "--crop-table", action='store_true', help="Detect text blocks only in rows of the table found on previous frames")
+    ap.add_argument("--text-detector", type=str, default=consts.DEFAULT_TEXT_DETECTOR, choices=list(cv_helpers.TEXT_DETECTORS), 
+        help="Text detection, east needs the EAST model at %s"%consts.EAST_MODEL_PATH)
+    ap.add_argument("-r", "--ocr-engine", type=str, default=consts.DEFAULT_OCR_ENGINE, choices=list(cv_helpers.OCR_ENGINES),
+        help="OCR engine, tesserocr keeps Tesseract loaded in every process")
+    ap.add_argument("-o", "--output", type=str, default="", help="Path to JSON report, printed if empty")
+    args = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    scaling_factors = list(map(int, args["scaling_factors"].split(",")))
+    n_procs = [n for n in map(int, args["n_proc"].split(",")) if n > 0]
+    options = {"batch": args["batch_rois"], "engine": args["ocr_engine"],
+        "reuse_layout": args["reuse_layout"], "reuse_keys": args["reuse_keys"],
+        "reuse_texts": args["reuse_texts"], "adaptive": args["adaptive_scaling"],
+        "crop_table": args["crop_table"], "detector": args["text_detector"]}
+    frames_fn = list_frames(args["frames"], args["limit"])
+    report = {
+        "commit": git_commit(),
+        "input": args["input"],
+        "frames": args["frames"],
+        "padding": args["padding"],
+        "scaling_factors": scaling_factors,
+        "video_similarity": args["video_similarity"],
+        "options": options
+    }
+    tmp = tempfile.mkdtemp()
+    try:
+        # stages are measured in this process, workers of parallel runs are not instrumented
+        timings = {}
+        patched = instrument(timings, args["video_similarity"])
+        try:
+            os.makedirs(os.path.join(tmp, "serial"))
+            n_read, n_kept, seconds = profile_extraction(args["input"], os.path.join(tmp, "serial"),
+                args["video_tolerance"], args["video_similarity"])
+            report["extraction"] = {"read": n_read, "kept": n_kept, "seconds": seconds, "fps": n_read/seconds}
+            data, seconds = profile_recognition(frames_fn, args["padding"], scaling_factors, options)
+            report["recognition"] = {"frames": len(frames_fn), "seconds": seconds, "fps": len(frames_fn)/seconds}
+            output_csv = os.path.join(tmp, "output.csv")
+            timed(timings, "csv", save_data)(data, output_csv)
+        finally:
+            restore(patched)
+        report["stages"] = dict((k, {"count": c, "seconds": t}) for k, (c, t) in sorted(timings.items()))
+
+        report["runs"] = []
+        for n_proc in n_procs:
+            folder = os.path.join(tmp, "parallel%d"%n_proc)
+            os.makedirs(folder)
+            start = time.perf_counter()
+            n_kept, _ = mp_helpers.extract_video(args["input"], folder, n_proc, True, args["video_tolerance"],
+                args["video_similarity"])
+            extract_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            n_done = sum(1 for _ in mp_helpers.recognise_files(frames_fn, n_proc, args["padding"], scaling_factors,
+                options=options))
+            recognise_seconds = time.perf_counter() - start
+            report["runs"].append({
+                "n_proc": n_proc,
+                "extract_seconds": extract_seconds,
+                "extracted": n_kept,
+                "recognise_seconds": recognise_seconds,
+                "recognise_fps": n_done/recognise_seconds
+            })
+
+        if args["reference_csv"]:
+            report["parity"] = check_parity(output_csv, args["reference_csv"], args["limit"] is None)
+        report["peak_rss"] = peak_rss()
+    finally:
+        shutil.rmtree(tmp)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args["output"]:
+        with open(args["output"], "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if "parity" in report and not report["parity"]["ok"]:
+        sys.exit(1)
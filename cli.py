@@ -7,32 +7,38 @@ __status__ = "Development"
 __date__ = "05/2019"
 __license__ = "MIT"
 
-import os, sys, argparse, time, math, logging
-import pandas as pd
-import multiprocessing as mp
+import os, sys, argparse, time, logging
 
-import recognizer, consts, cv_helpers
-
-def mp_job(fnames, q, padding=0, scaling_factor=1, debug=False):
-    for f in fnames:
-        has_value, has_none, result = recognizer.process_one_image(f, None, padding, scaling_factor, debug)
-        q.put(result)
-
-def append_result(res, data):
-    for k in res:
-        data[k].append(res[k])
+import recognizer, consts, cv_helpers, mp_helpers, store_helpers, profile_helpers, output_helpers, frame_helpers
 
 ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--input", type=str, help="Input image path")
+ap.add_argument("-i", "--input", type=str, help="Input image path, folder or frame cache (%s file)"%frame_helpers.FRAME_CACHE_EXTENSION)
 ap.add_argument("-o", "--output", type=str, help="Output image path")
-ap.add_argument("-c", "--output-csv", type=str, default="%s/pandas.csv"%consts.DEBUG_FOLDER, help="Path to output CSV file")
+ap.add_argument("-c", "--output-csv", type=str, default="%s/pandas.csv"%consts.DEBUG_FOLDER, help="Path to output CSV file, .parquet or .arrow files are written while frames are recognized and need pyarrow")
 ap.add_argument("-d", "--debug", type=bool, default=False, help="Debug mode")
 ap.add_argument("-v", "--video", type=bool, default=False, help="Extract video frames")
 ap.add_argument("-p", "--padding", type=int, default=0, help="Fixed padding")
 ap.add_argument("-n", "--n-proc", type=int, default=2, help="Number of cores for multiprocessing")
 ap.add_argument("-l", "--limit", type=int, default=None, help="Number of file to process")
 ap.add_argument("-s", "--scaling-factor", type=str, default="1", help="Scaling factor for Tesseract")
-ap.add_argument("-t", "--video-tolerance", type=float, default=.98, help="Tolerance for video import")
+ap.add_argument("-t", "--video-tolerance", type=float, default=None, help="Tolerance for video import, default depends on --video-similarity")
+ap.add_argument("--video-similarity", type=str, default=consts.DEFAULT_FRAME_SIMILARITY, choices=list(cv_helpers.FRAME_SIMILARITY), 
+    help="Way to compare video frames")
+ap.add_argument("-b", "--batch-rois", action='store_true', help="Recognize all ROIs of a frame with one Tesseract call")
+ap.add_argument("-L", "--reuse-layout", action='store_true', help="Reuse text block boxes of previous frames")
+ap.add_argument("-K", "--reuse-keys", action='store_true', help="Recognize only values once keys are learned")
+ap.add_argument("-T", "--reuse-texts", action='store_true', help="Reuse recognized text of unchanged ROIs")
+ap.add_argument("-A", "--adaptive-scaling", action='store_true', help="Try the most successful scaling factor first and retry only failed cells")
+ap.add_argument("-X", "--crop-table", action='store_true', help="Detect text blocks only in rows of the table found on previous frames")
+ap.add_argument("--text-detector", type=str, default=consts.DEFAULT_TEXT_DETECTOR, choices=list(cv_helpers.TEXT_DETECTORS), 
+    help="Text detection, east needs the EAST model at %s"%consts.EAST_MODEL_PATH)
+ap.add_argument("--detect-batch", type=int, default=1, help="Number of frames of which text blocks are detected in one pass, for --text-detector=east")
+ap.add_argument("-r", "--ocr-engine", type=str, default=consts.DEFAULT_OCR_ENGINE, choices=list(cv_helpers.OCR_ENGINES), 
+    help="OCR engine, tesserocr keeps Tesseract loaded in every process")
+ap.add_argument("--seek-frames", action='store_true', help="Seek to video segments by frame number instead of starting at the keyframe before them, exact only for constant frame rate")
+ap.add_argument("-R", "--resume", action='store_true', help="Store results next to the output CSV and recognize only files without stored result")
+ap.add_argument("--profile", action='store_true', help="Log duration histograms of processing steps of all workers")
+ap.add_argument("--profile-trace", type=str, default="", help="Write durations of every step to Chrome trace file, enables --profile")
 args = vars(ap.parse_args())
 
 handlers = [logging.StreamHandler()]
@@ -44,6 +50,14 @@ logging.basicConfig(
 logger = logging.getLogger('')
 
 args["scaling_factor"] = list(map(int, args["scaling_factor"].split(",")))
+options = {"batch": args["batch_rois"], "engine": args["ocr_engine"], 
+    "reuse_layout": args["reuse_layout"], "reuse_keys": args["reuse_keys"], 
+    "reuse_texts": args["reuse_texts"], "adaptive": args["adaptive_scaling"],
+    "crop_table": args["crop_table"], "detector": args["text_detector"]}
+profile = None
+if args["profile"] or args["profile_trace"]:
+    profile = {"trace": len(args["profile_trace"]) > 0}
+    profile_helpers.enable(**profile)
 for f in consts.FOLDERS:
     if not os.path.exists("build"):
         os.makedirs("build")
@@ -56,82 +70,60 @@ if args["video"]:
     if not os.path.exists(args["output"]):
         os.makedirs(args["output"])
 
-    tolerance = args["video_tolerance"]
-    n_proc = args["n_proc"]
-    n_frames, fps = cv_helpers.get_video_n_frames(args["input"])
-
-    if fps == 0:
-        fps = 1
-        n_proc = 1
-        logger.warning("Could not detect video FPS, fallback to 1 thread")
-        n_jobs = n_frames
-        procs = [mp.Process(target=cv_helpers.get_video_frames, 
-            args=(args["input"], args["output"], None, None, tolerance)) for i in range(n_proc)]
-    else:
-        frames = list(range(0, n_frames, fps))
-        _, middle_frame = cv_helpers.get_video_frame(args["input"], frames[math.floor(len(frames)/2)])
-        n_jobs = len(frames)
-        p_index = list(range(n_jobs))
-        chunk_size = int(math.ceil(n_jobs/n_proc))
-        res = [frames[i:i+chunk_size] for i in range(0, n_jobs, chunk_size)]
-        n_proc = len(res)
-
-        procs = [mp.Process(target=cv_helpers.get_video_frames, 
-            args=(args["input"], args["output"], res[i], middle_frame, tolerance)) for i in range(n_proc)]
-    
     start = time.time()
-    for p in procs:
-        p.start()
-    logger.info("Extracting %d frames in %d thread(s)"%(n_jobs, n_proc))
-    for p in procs:
-        p.join()
+    n_jobs, _ = mp_helpers.extract_video(args["input"], args["output"], args["n_proc"], not args["seek_frames"], 
+        args["video_tolerance"], args["video_similarity"])
     logger.info("Extracted %d in %.2f s"%(n_jobs, time.time() - start))
     sys.exit()
 
-data = {}
-for k in consts.EXPECTED_KEYS:
-    data[k] = []
-data["file"] = []
-if os.path.isfile(args["input"]):
+writer = output_helpers.open_writer(args["output_csv"])
+if os.path.isfile(args["input"]) and not frame_helpers.is_frame_cache(args["input"]):
     logger.info("Parsing file %s"%args["input"])
     has_value, has_none, res = recognizer.process_one_image(args["input"], args["output"], 
-        args["padding"], args["scaling_factor"], debug=args["debug"])
-    append_result(res, data)
+        args["padding"], args["scaling_factor"], debug=args["debug"], **options)
+    writer.write(res)
+    writer.close()
 else:
     folder = args["input"]
-    logger.info("Parsing folder %s"%folder)
-
+    frame_cache = None
     frames_fn = []
-    idx = 0
-    for f in os.listdir(folder):
-        if f.endswith(".png"):
-            frames_fn.append(os.path.join(folder, f))
-        idx += 1
-        if args["limit"] is not None and args["limit"] > 0 and idx == args["limit"]:
-            break
+    if frame_helpers.is_frame_cache(folder):
+        logger.info("Parsing frame cache %s"%folder)
+        frame_cache = folder
+        frames_fn = frame_helpers.FrameCache(folder).names()
+        if args["limit"] is not None and args["limit"] > 0:
+            frames_fn = frames_fn[:args["limit"]]
+    else:
+        logger.info("Parsing folder %s"%folder)
+        idx = 0
+        for f in os.listdir(folder):
+            if f.endswith(".png"):
+                frames_fn.append(os.path.join(folder, f))
+            idx += 1
+            if args["limit"] is not None and args["limit"] > 0 and idx == args["limit"]:
+                break
 
-    q = mp.Queue()
     n_proc = args["n_proc"]
     n_jobs = len(frames_fn)
-    p_index = list(range(n_jobs))
-    chunk_size = int(math.ceil(n_jobs/n_proc))
-    res = [frames_fn[i:i+chunk_size] for i in range(0, n_jobs, chunk_size)]
-    n_proc = len(res)
     start = time.time()
 
-    procs = [mp.Process(target=mp_job, args=(res[i], q, args["padding"], 
-        args["scaling_factor"], args["debug"])) for i in range(n_proc)]
-    for p in procs:
-        p.start()
+    store = None
+    if args["resume"]:
+        params = {"padding": args["padding"], "scaling_factor": args["scaling_factor"]}
+        params.update(options)
+        store = store_helpers.ResultStore(os.path.splitext(args["output_csv"])[0] + ".db", params)
 
     logger.info("Starting jobs in %d thread(s)"%n_proc)
-    for p in procs:
-        p.join()
-
-    while not q.empty():
-        append_result(q.get(), data)
+    try:
+        for result in mp_helpers.recognise_files(frames_fn, n_proc, args["padding"], 
+                args["scaling_factor"], args["debug"], options=options, store=store, profile=profile, 
+                detect_batch=args["detect_batch"], frame_cache=frame_cache):
+            writer.write(result)
+    finally:
+        if store is not None:
+            store.close()
+        writer.close()
     logger.info("Parsed %d in %.2f s"%(n_jobs, time.time() - start))
-
-df = pd.DataFrame(data=data)
-df = df.groupby("timestamp").first().sort_values(by=["timestamp"]).reset_index()
-df.to_csv(args["output_csv"])
\ No newline at end of file
+profile_helpers.log_summary()
+if args["profile_trace"]:
+    profile_helpers.save_trace(args["profile_trace"])
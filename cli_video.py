@@ -7,97 +7,160 @@ __status__ = "Development"
 __date__ = "05/2019"
 __license__ = "MIT"
 
-import os, sys, argparse, time, math, logging
-import pandas as pd
-import multiprocessing as mp
+import os, sys, glob, argparse, time, logging
 
-import recognizer, consts, cv_helpers
+import consts, cv_helpers, mp_helpers, store_helpers, profile_helpers, output_helpers, frame_helpers
 
 DEFAULT_PADDING = 20
 
-def mp_job(fnames, q, padding=0, scaling_factor=1, debug=False):
-    for f in fnames:
-        has_value, has_none, result = recognizer.process_one_image(f, None, padding, scaling_factor, debug)
-        q.put(result)
+VIDEO_EXTENSIONS = [".mp4", ".mov", ".m4v"]
+MANIFEST_EXTENSIONS = [".txt", ".lst"]
 
-def append_result(res, data):
-    for k in res:
-        data[k].append(res[k])
+def list_recordings(input_path):
+    """Find video files: the video file itself, video files in a folder, files matching a glob pattern
+    or files listed in a text file, one path per line relative to the text file, # starts a comment
 
-def extract_frames(input_path, output_folder, n_proc):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    n_frames, fps = cv_helpers.get_video_n_frames(input_path)
-    if fps == 0:
-        fps = 1
-        n_proc = 1
-        logger.warning("Could not detect video FPS, fallback to 1 thread")
-        n_jobs = n_frames
-        procs = [mp.Process(target=cv_helpers.get_video_frames, 
-            args=(input_path, output_folder, None, None)) for i in range(n_proc)]
-    else:
-        frames = list(range(0, n_frames, fps))
-        _, middle_frame = cv_helpers.get_video_frame(input_path, frames[math.floor(len(frames)/2)])
-        n_jobs = len(frames)
-        p_index = list(range(n_jobs))
-        chunk_size = int(math.ceil(n_jobs/n_proc))
-        res = [frames[i:i+chunk_size] for i in range(0, n_jobs, chunk_size)]
-        n_proc = len(res)
+    Arguments:
+        input_path {str} -- video file, folder, glob pattern or text file
 
-        procs = [mp.Process(target=cv_helpers.get_video_frames, 
-            args=(input_path, output_folder, res[i], middle_frame)) for i in range(n_proc)]
+    Returns:
+        list -- paths to video files
+    """
+    if os.path.isdir(input_path):
+        return sorted(os.path.join(input_path, f) for f in os.listdir(input_path) 
+            if os.path.splitext(f)[1].lower() in VIDEO_EXTENSIONS)
+    if os.path.isfile(input_path):
+        if os.path.splitext(input_path)[1].lower() not in MANIFEST_EXTENSIONS:
+            return [input_path]
+        recordings = []
+        with open(input_path) as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if len(line) > 0:
+                    recordings.append(os.path.join(os.path.dirname(input_path), line))
+        return recordings
+    return sorted(glob.glob(input_path, recursive=True))
 
+def extract_frames(input_path, output_folder, n_proc, sequential=True, tolerance=None, 
+        similarity=consts.DEFAULT_FRAME_SIMILARITY, frame_cache=None):
+    if frame_cache is None and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
     start = time.time()
-    for p in procs:
-        p.start()
-    logger.info("Extracting %d frames in %d thread(s)"%(n_jobs, n_proc))
-    for p in procs:
-        p.join()
+    n_jobs, _ = mp_helpers.extract_video(input_path, output_folder, n_proc, sequential, tolerance, similarity, 
+        frame_cache)
     logger.info("Extracted %d in %.2f s"%(n_jobs, time.time() - start))
 
-def parse_folder(folder, output_csv, n_proc, scaling_factor):
-    data = {}
-    for k in consts.EXPECTED_KEYS:
-        data[k] = []
-    data["file"] = []
-
-    logger.info("Parsing folder %s"%folder)
+def parse_folder(folder, output_path, n_proc, scaling_factor, options=None, store=None, profile=None, detect_batch=1):
+    frame_cache = None
     frames_fn = []
-    for f in os.listdir(folder):
-        if f.endswith(".png"):
-            frames_fn.append(os.path.join(folder, f))
+    if frame_helpers.is_frame_cache(folder):
+        logger.info("Parsing frame cache %s"%folder)
+        frame_cache = folder
+        frames_fn = frame_helpers.FrameCache(folder).names()
+    else:
+        logger.info("Parsing folder %s"%folder)
+        for f in os.listdir(folder):
+            if f.endswith(".png"):
+                frames_fn.append(os.path.join(folder, f))
 
-    q = mp.Queue()
     n_jobs = len(frames_fn)
-    p_index = list(range(n_jobs))
-    chunk_size = int(math.ceil(n_jobs/n_proc))
-    res = [frames_fn[i:i+chunk_size] for i in range(0, n_jobs, chunk_size)]
-    n_proc = len(res)
     start = time.time()
 
-    procs = [mp.Process(target=mp_job, args=(res[i], q, DEFAULT_PADDING, 
-        scaling_factor)) for i in range(n_proc)]
-    for p in procs:
-        p.start()
-
     logger.info("Starting text recognition in %d thread(s)"%n_proc)
-    for p in procs:
-        p.join()
-
-    while not q.empty():
-        append_result(q.get(), data)
+    writer = output_helpers.open_writer(output_path)
+    try:
+        for result in mp_helpers.recognise_files(frames_fn, n_proc, DEFAULT_PADDING, scaling_factor, options=options, 
+                store=store, profile=profile, detect_batch=detect_batch, frame_cache=frame_cache):
+            writer.write(result)
+    finally:
+        writer.close()
     logger.info("Processed %d frames in %.2f s"%(n_jobs, time.time() - start))
 
-    df = pd.DataFrame(data=data)
-    df = df.groupby("timestamp").first().sort_values(by=["timestamp"]).reset_index()
-    df.to_csv(output_csv)   
+def parse_video(input_path, output_folder, output_path, n_proc, scaling_factor, save_frames=False, sequential=True,
+        tolerance=None, similarity=consts.DEFAULT_FRAME_SIMILARITY, options=None, store=None, profile=None, detect_batch=1,
+        shared_memory=False):
+    if save_frames and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    logger.info("Streaming video %s to text recognition in %d thread(s)"%(input_path, n_proc))
+    start = time.time()
+    writer = output_helpers.open_writer(output_path)
+    try:
+        for result in mp_helpers.stream_video(input_path, output_folder, n_proc, DEFAULT_PADDING, 
+                scaling_factor, save_frames, sequential, tolerance=tolerance, similarity=similarity, options=options, 
+                store=store, profile=profile, detect_batch=detect_batch, shared_memory=shared_memory):
+            writer.write(result)
+    finally:
+        writer.close()
+    logger.info("Processed %d frames in %.2f s"%(writer.n_results, time.time() - start))
+
+def parse_recordings(recordings, combined_path, n_proc, scaling_factor, output_format="csv", extract=True, recognise=True,
+        sequential=True, tolerance=None, similarity=consts.DEFAULT_FRAME_SIMILARITY, options=None, store_params=None, 
+        profile=None, detect_batch=1):
+    folders = [os.path.splitext(r)[0] for r in recordings]
+    outputs = [(f, f + "." + output_format) for f in folders]
+    stores = None
+    if store_params is not None:
+        stores = [store_helpers.ResultStore(f + ".db", store_params) for f in folders]
+    writers = [output_helpers.open_writer(path) for _, path in outputs] if recognise else []
+
+    logger.info("Processing %d recordings in %d thread(s)"%(len(recordings), n_proc))
+    start = time.time()
+    try:
+        for i, result in mp_helpers.process_recordings(list(zip(recordings, folders)), n_proc, DEFAULT_PADDING, 
+                scaling_factor, options=options, profile=profile, extract=extract, recognise=recognise, 
+                sequential=sequential, tolerance=tolerance, similarity=similarity, stores=stores, 
+                detect_batch=detect_batch):
+            if result is not None:
+                writers[i].write(result)
+            elif recognise:
+                writers[i].close()
+                writers[i] = None
+                logger.info("Processed %s"%recordings[i])
+    finally:
+        for w in writers:
+            if w is not None:
+                w.close()
+        if stores is not None:
+            for store in stores:
+                store.close()
+    logger.info("Processed %d recordings in %.2f s"%(len(recordings), time.time() - start))
+    if recognise:
+        output_helpers.combine_outputs(outputs, combined_path)
+        logger.info("Combined results saved to %s"%combined_path)
 
 ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--input", required=True, type=str, help="Path to video file")
+ap.add_argument("-i", "--input", required=True, type=str, 
+    help="Path to video file, folder with video files, glob pattern or text file with one video path per line")
 ap.add_argument("-n", "--n-proc", type=int, default=4, help="Number of cores for multiprocessing")
 ap.add_argument("-e", "--skip-extracting", action='store_true', help="Skip extracting images")
 ap.add_argument("-p", "--skip-parsing", action='store_true', help="Skip parsing images")
+ap.add_argument("-m", "--stream", action='store_true', help="Pass decoded frames to text recognition in memory")
+ap.add_argument("--save-frames", action='store_true', help="Write frame images in stream mode")
+ap.add_argument("--shared-memory", action='store_true', help="Pass decoded frames to text recognition through shared memory in stream mode")
+ap.add_argument("-M", "--frame-cache", action='store_true', help="Keep extracted frames in one memory-mapped file instead of PNG files")
+ap.add_argument("-t", "--video-tolerance", type=float, default=None, help="Tolerance to skip similar frames, default depends on --video-similarity")
+ap.add_argument("--video-similarity", type=str, default=consts.DEFAULT_FRAME_SIMILARITY, choices=list(cv_helpers.FRAME_SIMILARITY), 
+    help="Way to compare video frames")
+ap.add_argument("--seek-frames", action='store_true', help="Seek by frame number to every sampled frame with --stream and to video segments otherwise, instead of decoding the stream once or from the keyframe before a segment, exact only for constant frame rate")
 ap.add_argument("-s", "--scaling-factors", type=str, default="5,4,3,2", help="Scaling factor to resize for Tesseract")
+ap.add_argument("-b", "--batch-rois", action='store_true', help="Recognize all ROIs of a frame with one Tesseract call")
+ap.add_argument("-L", "--reuse-layout", action='store_true', help="Reuse text block boxes of previous frames")
+ap.add_argument("-K", "--reuse-keys", action='store_true', help="Recognize only values once keys are learned")
+ap.add_argument("-T", "--reuse-texts", action='store_true', help="Reuse recognized text of unchanged ROIs")
+ap.add_argument("-A", "--adaptive-scaling", action='store_true', help="Try the most successful scaling factor first and retry only failed cells")
+ap.add_argument("-X", "--crop-table", action='store_true', help="Detect text blocks only in rows of the table found on previous frames")
+ap.add_argument("--text-detector", type=str, default=consts.DEFAULT_TEXT_DETECTOR, choices=list(cv_helpers.TEXT_DETECTORS), 
+    help="Text detection, east needs the EAST model at %s"%consts.EAST_MODEL_PATH)
+ap.add_argument("--detect-batch", type=int, default=1, help="Number of frames of which text blocks are detected in one pass, for --text-detector=east")
+ap.add_argument("-r", "--ocr-engine", type=str, default=consts.DEFAULT_OCR_ENGINE, choices=list(cv_helpers.OCR_ENGINES), 
+    help="OCR engine, tesserocr keeps Tesseract loaded in every process")
+ap.add_argument("-F", "--output-format", type=str, default="csv", choices=["csv", "parquet", "arrow"], 
+    help="Format of the output file, parquet and arrow are written while frames are recognized and need pyarrow")
+ap.add_argument("-C", "--combined-output", type=str, default="", 
+    help="Output file with results of all recordings, combined.<format> in the common folder of recordings by default")
+ap.add_argument("-R", "--resume", action='store_true', help="Store results next to the output CSV and recognize only frames without stored result")
+ap.add_argument("--profile", action='store_true', help="Log duration histograms of processing steps of all workers")
+ap.add_argument("--profile-trace", type=str, default="", help="Write durations of every step to Chrome trace file, enables --profile")
 ap.add_argument("-d", "--debug-level", type=str, default="info", help="Debug level")
 ap.add_argument("-f", "--debug-file", type=str, default="", help="Output logs to file")
 ap.add_argument("-o", "--silent", action='store_true', help="Do not output logs to STDOUT")
@@ -131,17 +194,68 @@ logging.basicConfig(
     handlers=handlers)
 
 logger = logging.getLogger('')
-if not os.path.exists(args["input"]) or not os.path.isfile(args["input"]):
-    logger.critical("File %s not found, exiting"%args["input"])
+recordings = list_recordings(args["input"])
+if len(recordings) == 0:
+    logger.critical("No video found in %s, exiting"%args["input"])
     sys.exit()
+for r in recordings:
+    if not os.path.isfile(r):
+        logger.critical("File %s not found, exiting"%r)
+        sys.exit()
 
 scaling_factors = list(map(int, args["scaling_factors"].split(",")))
 n_proc = args["n_proc"]
 output_folder = os.path.splitext(args["input"])[0]
-output_csv = output_folder + ".csv"
+output_path = output_folder + "." + args["output_format"]
+frame_cache = output_folder + frame_helpers.FRAME_CACHE_EXTENSION if args["frame_cache"] else None
+options = {"batch": args["batch_rois"], "engine": args["ocr_engine"], 
+    "reuse_layout": args["reuse_layout"], "reuse_keys": args["reuse_keys"], 
+    "reuse_texts": args["reuse_texts"], "adaptive": args["adaptive_scaling"],
+    "crop_table": args["crop_table"], "detector": args["text_detector"]}
 
-if not args["skip_extracting"]:
-    extract_frames(args["input"], output_folder, n_proc)
+profile = None
+if args["profile"] or args["profile_trace"]:
+    profile = {"trace": len(args["profile_trace"]) > 0}
+    profile_helpers.enable(**profile)
+
+store_params = None
+if args["resume"]:
+    store_params = {"padding": DEFAULT_PADDING, "scaling_factor": scaling_factors}
+    store_params.update(options)
+
+store = None
+try:
+    if recordings != [args["input"]]:
+        if args["stream"]:
+            logger.warning("Stream mode is not supported for many recordings, writing frames to folders")
+        if args["frame_cache"]:
+            logger.warning("Frame cache is not supported for many recordings, writing frames to folders")
+        combined_path = args["combined_output"]
+        if len(combined_path) == 0:
+            folder = os.path.commonpath([os.path.dirname(os.path.abspath(r)) for r in recordings])
+            combined_path = os.path.join(folder, "combined." + args["output_format"])
+        parse_recordings(recordings, combined_path, n_proc, scaling_factors, args["output_format"], 
+            not args["skip_extracting"], not args["skip_parsing"], not args["seek_frames"], args["video_tolerance"], 
+            args["video_similarity"], options, store_params, profile, args["detect_batch"])
+    elif args["stream"]:
+        if store_params is not None:
+            store = store_helpers.ResultStore(output_folder + ".db", store_params)
+        parse_video(args["input"], output_folder, output_path, n_proc, scaling_factors, 
+            args["save_frames"], not args["seek_frames"], args["video_tolerance"], args["video_similarity"], options, store, profile, 
+            args["detect_batch"], args["shared_memory"])
+    else:
+        if not args["skip_extracting"]:
+            extract_frames(args["input"], output_folder, n_proc, not args["seek_frames"], args["video_tolerance"], 
+                args["video_similarity"], frame_cache)
 
-if not args["skip_parsing"]:
-    parse_folder(output_folder, output_csv, n_proc, scaling_factors)
\ No newline at end of file
+        if not args["skip_parsing"]:
+            if store_params is not None:
+                store = store_helpers.ResultStore(output_folder + ".db", store_params)
+            parse_folder(output_folder if frame_cache is None else frame_cache, output_path, n_proc, scaling_factors, 
+                options, store, profile, args["detect_batch"])
+finally:
+    if store is not None:
+        store.close()
+    profile_helpers.log_summary()
+    if args["profile_trace"]:
+        profile_helpers.save_trace(args["profile_trace"])
\ No newline at end of file
@@ -14,6 +14,18 @@ CHECK_REPLACE = 1
 CHECK_DISTANCE = 2
 
 TESSERACT_CONF = '--psm 6'
+DEFAULT_OCR_ENGINE = "pytesseract"
+
+DEFAULT_FRAME_SIMILARITY = "ssim-gray"
+
+# text detection, "contours" or "east"
+DEFAULT_TEXT_DETECTOR = "contours"
+EAST_MODEL_PATH = "assets/frozen_east_text_detection.pb"
+# (height, width) of the EAST input, multiples of 32
+EAST_TARGET_SIZE = (800, 800)
+
+# ROIs of a frame are stacked in one column of lines with different height
+TESSERACT_BATCH_CONF = '--psm 4'
 
 TRIGGER_WORD = "back"
 
@@ -37,40 +49,48 @@ EXPECTED_KEYS = {
     "phy_cell_id": {
         "corr": CHECK_DISTANCE,
         "map": int,
-        "range": (0, 503)
+        "range": (0, 503),
+        "dtype": "int32"
     },
     "timestamp": {
         "corr": CHECK_DISTANCE,
-        "map": parser.parse
+        "map": parser.parse,
+        "dtype": "timestamp"
     },
     "rsrp0": {
         "corr": CHECK_REPLACE,
         "map": int,
-        "range": (-150, -40)
+        "range": (-150, -40),
+        "dtype": "int16"
     },
     "rsrp1": {
         "corr": CHECK_REPLACE,
         "map": int,
-        "range": (-150, -40)
+        "range": (-150, -40),
+        "dtype": "int16"
     },
     "rsrq0": {
         "corr": CHECK_REPLACE,
         "map": int,
-        "range": (-51, -1)
+        "range": (-51, -1),
+        "dtype": "int16"
     },
     "rsrq1": {
         "corr": CHECK_REPLACE,
         "map": int,
-        "range": (-51, -1)
+        "range": (-51, -1),
+        "dtype": "int16"
     },
     "sinr0": {
         "corr": CHECK_REPLACE,
         "map": float,
-        "range": (-40, 40)
+        "range": (-40, 40),
+        "dtype": "float32"
     },
     "sinr1": {
         "corr": CHECK_REPLACE,
         "map": float,
-        "range": (-40, 40)
+        "range": (-40, 40),
+        "dtype": "float32"
     }
 }
\ No newline at end of file
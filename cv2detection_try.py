@@ -9,23 +9,67 @@ __license__ = "MIT"
 
 import numpy as np
 import cv2
-import argparse, time
+import argparse, time, logging
 import imutils
 
-from imutils.object_detection import non_max_suppression
 from imutils import contours
 
-def detect_text(image, east_model_path, layers=["feature_fusion/Conv_7/Sigmoid", "feature_fusion/concat_3"]):
+import consts, profile_helpers
+
+logger = logging.getLogger('')
+
+EAST_LAYERS = ["feature_fusion/Conv_7/Sigmoid", "feature_fusion/concat_3"]
+
+# networks loaded in this process, model path to cv2.dnn.Net
+_nets = {}
+
+def get_net(east_model_path):
+    """Load EAST network once per process
+    
+    Arguments:
+        east_model_path {str} -- path to frozen EAST model
+    
+    Returns:
+        cv2.dnn.Net -- network
+    """
+    if east_model_path not in _nets:
+        _nets[east_model_path] = cv2.dnn.readNet(east_model_path)
+    return _nets[east_model_path]
+
+def detect_text(image, east_model_path, layers=EAST_LAYERS):
     size_reversed = (image.shape[:2][1], image.shape[:2][0])
-    net = cv2.dnn.readNet(east_model_path)
+    net = get_net(east_model_path)
     blob = cv2.dnn.blobFromImage(image, 1.0, size_reversed, (123.68, 116.78, 103.94), swapRB = True, crop = False)
     start = time.time()
     net.setInput(blob)
     (scores, geometry) = net.forward(layers)
     end = time.time()
-    print("[INFO] text detection took {:.4f} seconds".format(end-start))
+    logger.debug("Text detection took {:.4f} seconds".format(end-start))
     return scores, geometry
 
+def detect_text_batch(images, east_model_path, layers=EAST_LAYERS):
+    """Run the network once for several images of the same size
+    
+    Arguments:
+        images {list} -- images of the same size, multiples of 32
+        east_model_path {str} -- path to frozen EAST model
+    
+    Keyword Arguments:
+        layers {list} -- names of score and geometry layers (default: {EAST_LAYERS})
+    
+    Returns:
+        list -- (scores, geometry) of every image, as detect_text returns them
+    """
+    size_reversed = (images[0].shape[:2][1], images[0].shape[:2][0])
+    net = get_net(east_model_path)
+    blob = cv2.dnn.blobFromImages(images, 1.0, size_reversed, (123.68, 116.78, 103.94), swapRB = True, crop = False)
+    start = time.time()
+    net.setInput(blob)
+    (scores, geometry) = net.forward(layers)
+    end = time.time()
+    logger.debug("Text detection of {} images took {:.4f} seconds".format(len(images), end-start))
+    return [(scores[i:i+1], geometry[i:i+1]) for i in range(len(images))]
+
 def show_boxes(image, boxes):
     output = image.copy()
     for ((startX, startY, endX, endY), text) in boxes:
@@ -63,44 +107,53 @@ def open_image(image_path):
     return cv2.imread(image_path)
 
 def decode_predictions(scores, geometry, min_confidence=0.5):
-    # grab the number of rows and columns from the scores volume, then
-    # initialize our set of bounding box rectangles and corresponding confidence scores
-    (numRows, numCols) = scores.shape[2:4]
-    rects = []
-    confidences = []
-    # loop over the number of rows
-    for y in range(0, numRows):
-        # extract the scores (probabilities), followed by the
-        # geometrical data used to derive potential bounding box coordinates that surround text
-        scoresData = scores[0, 0, y]
-        xData0 = geometry[0, 0, y]
-        xData1 = geometry[0, 1, y]
-        xData2 = geometry[0, 2, y]
-        xData3 = geometry[0, 3, y]
-        anglesData = geometry[0, 4, y]
-        # loop over the number of columns
-        for x in range(0, numCols):
-            # if our score does not have sufficient probability, ignore it
-            if scoresData[x] < min_confidence:
-                continue
-            # compute the offset factor as our resulting feature maps will be 4x smaller than the input image
-            (offsetX, offsetY) = (x * 4.0, y * 4.0)
-            # extract the rotation angle for the prediction and then compute the sin and cosine
-            angle = anglesData[x]
-            cos = np.cos(angle)
-            sin = np.sin(angle) 
-            # use the geometry volume to derive the width and height of the bounding box
-            h = xData0[x] + xData2[x]
-            w = xData1[x] + xData3[x]
-            # compute both the starting and ending (x, y)-coordinates for the text prediction bounding box
-            endX = int(offsetX + (cos * xData1[x]) + (sin * xData2[x]))
-            endY = int(offsetY - (sin * xData1[x]) + (cos * xData2[x]))
-            startX = int(endX - w)
-            startY = int(endY - h)
-            # add the bounding box coordinates and probability score to our respective lists
-            rects.append((startX, startY, endX, endY))
-            confidences.append(scoresData[x])
-    return rects, confidences
+    """Get boxes of all cells of the score map above min_confidence at once
+    
+    Arguments:
+        scores {np.array} -- score map of one image, shape (1, 1, rows, cols)
+        geometry {np.array} -- geometry of one image, shape (1, 5, rows, cols)
+    
+    Keyword Arguments:
+        min_confidence {float} -- minimum score of a cell (default: {0.5})
+    
+    Returns:
+        (np.array, np.array) -- ((startX, startY, endX, endY) rows, score of every box)
+    """
+    ys, xs = np.nonzero(scores[0, 0] >= min_confidence)
+    # every cell of the maps covers 4x4 pixels of the input image
+    offset_x = xs*4.0
+    offset_y = ys*4.0
+    x0, x1, x2, x3, angle = geometry[0, :, ys, xs].T
+    cos = np.cos(angle)
+    sin = np.sin(angle)
+    h = x0 + x2
+    w = x1 + x3
+    end_x = np.trunc(offset_x + cos*x1 + sin*x2)
+    end_y = np.trunc(offset_y - sin*x1 + cos*x2)
+    start_x = np.trunc(end_x - w)
+    start_y = np.trunc(end_y - h)
+    rects = np.stack([start_x, start_y, end_x, end_y], axis=1).astype(int)
+    return rects, scores[0, 0, ys, xs]
+
+def non_max_suppression(rects, confidences, min_confidence=0.5, overlap_threshold=0.3):
+    """Drop boxes overlapping a box with higher score, all boxes are compared in one call
+    
+    Arguments:
+        rects {np.array} -- (startX, startY, endX, endY) rows
+        confidences {np.array} -- score of every box
+    
+    Keyword Arguments:
+        min_confidence {float} -- minimum score of a box (default: {0.5})
+        overlap_threshold {float} -- maximum intersection over union of kept boxes (default: {0.3})
+    
+    Returns:
+        np.array -- (startX, startY, endX, endY) rows of kept boxes
+    """
+    if len(rects) == 0:
+        return np.zeros((0, 4), int)
+    boxes = np.column_stack([rects[:, :2], rects[:, 2:] - rects[:, :2]])
+    keep = cv2.dnn.NMSBoxes(boxes.tolist(), np.asarray(confidences, float).tolist(), min_confidence, overlap_threshold)
+    return rects[np.array(keep, int).reshape(-1)]
 
 def get_actual_boxes(boxes, resized_ratio, original_size, padding=0.0):
     (original_height, original_width) = original_size
@@ -140,31 +193,71 @@ def save_with_countrous(image, cnts, output_path="output/test.png"):
         cv2.rectangle(clone, (x, y), (x + w, y + h), (0, 255, 0), 2)
     cv2.imwrite(output_path, clone)
 
-ap = argparse.ArgumentParser()
-ap.add_argument("-east", "--east", default="assets/frozen_east_text_detection.pb", type = str, help = "path to input EAST Detector")
-ap.add_argument("-w", "--width", type = int,
-	default = 800, help = "resized image width(should be multiple of 32)")
-ap.add_argument("-e", "--height", type = int,
-	default = 800, help = "resized image height(should be multiple of 32)")
-ap.add_argument("-c", "--min-confidence", type = float,
-	default = .5, help = "minimum probability required to inspect a region")
-ap.add_argument("-p", "--padding", type=float, default=0.0,
-	help="amount of padding to add to each border of ROI")
-ap.add_argument("-i", "--input", type=str, help="Input image path")
-ap.add_argument("-o", "--output", type=str, help="Output image path")
-args = vars(ap.parse_args())
-
-def process_one_image(input_path, output_path):
-    target_size = (args["height"], args["width"])
+class EastDetector:
+    """Text detection with EAST network as alternative to contours of cv_helpers.preprocess_image,
+    the network is loaded once per process"""
+
+    def __init__(self, east_model_path=consts.EAST_MODEL_PATH, target_size=consts.EAST_TARGET_SIZE, 
+            min_confidence=0.5, padding=0.0):
+        """Load the network
+        
+        Keyword Arguments:
+            east_model_path {str} -- path to frozen EAST model (default: {consts.EAST_MODEL_PATH})
+            target_size {tuple} -- (height, width) of the network input, multiples of 32 (default: {consts.EAST_TARGET_SIZE})
+            min_confidence {float} -- minimum score of a box (default: {0.5})
+            padding {float} -- padding added to boxes relative to their size (default: {0.0})
+        """
+        self.east_model_path = east_model_path
+        self.target_size = target_size
+        self.min_confidence = min_confidence
+        self.padding = padding
+        get_net(east_model_path)
 
+    @profile_helpers.timed("detect_text")
+    def detect(self, image):
+        """Find boxes of text on the image
+        
+        Arguments:
+            image {cv2.image} -- BGR image
+        
+        Returns:
+            list -- list of (x, y, w, h) tuples from top to bottom
+        """
+        resized, resized_ratio = resize_image(preprocess_image(image), self.target_size)
+        scores, geometry = detect_text(resized, self.east_model_path)
+        return self.get_boxes(scores, geometry, resized_ratio, image.shape[:2])
+
+    @profile_helpers.timed("detect_text_batch")
+    def detect_batch(self, images):
+        """Find boxes of text on several images with one pass of the network
+        
+        Arguments:
+            images {list} -- BGR images
+        
+        Returns:
+            list -- boxes of every image, as detect returns them
+        """
+        resized = [resize_image(preprocess_image(image), self.target_size) for image in images]
+        predictions = detect_text_batch([r for r, _ in resized], self.east_model_path)
+        return [self.get_boxes(scores, geometry, ratio, image.shape[:2]) 
+            for image, (_, ratio), (scores, geometry) in zip(images, resized, predictions)]
+
+    def get_boxes(self, scores, geometry, resized_ratio, original_size):
+        rects, confidences = decode_predictions(scores, geometry, self.min_confidence)
+        boxes = non_max_suppression(rects, confidences, self.min_confidence)
+        results = get_actual_boxes(boxes, resized_ratio, original_size, padding=self.padding)
+        return [(x0, y0, x1 - x0, y1 - y0) for (x0, y0, x1, y1), _ in results]
+
+def process_one_image(input_path, output_path, east_model_path=consts.EAST_MODEL_PATH, target_size=consts.EAST_TARGET_SIZE, 
+        min_confidence=0.5, padding=0.0):
     original_image = open_image(input_path)
     original_size = original_image.shape[:2]
     processed_image = preprocess_image(original_image)
     image, resized_ratio = resize_image(processed_image, target_size)
-    scores, geometry = detect_text(image, args["east"])
-    rects, confidences = decode_predictions(scores, geometry, args["min_confidence"])
-    boxes = non_max_suppression(np.array(rects), probs=confidences)
-    results = get_actual_boxes(boxes, resized_ratio, original_size, padding=args["padding"])
+    scores, geometry = detect_text(image, east_model_path)
+    rects, confidences = decode_predictions(scores, geometry, min_confidence)
+    boxes = non_max_suppression(rects, confidences, min_confidence)
+    results = get_actual_boxes(boxes, resized_ratio, original_size, padding=padding)
     save_with_boxes(original_image, results, output_path)
 
 def process_one_image_1(input_path, output_path):
@@ -173,5 +266,20 @@ def process_one_image_1(input_path, output_path):
     cnts = find_countours(processed_image)
     save_with_countrous(original_image, cnts, output_path=output_path)
 
-# for i in range(138):
-process_one_image("build/images/test3/frame0.png", "screenshots/test2.png")
\ No newline at end of file
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-east", "--east", default=consts.EAST_MODEL_PATH, type = str, help = "path to input EAST Detector")
+    ap.add_argument("-w", "--width", type = int,
+        default = consts.EAST_TARGET_SIZE[1], help = "resized image width(should be multiple of 32)")
+    ap.add_argument("-e", "--height", type = int,
+        default = consts.EAST_TARGET_SIZE[0], help = "resized image height(should be multiple of 32)")
+    ap.add_argument("-c", "--min-confidence", type = float,
+        default = .5, help = "minimum probability required to inspect a region")
+    ap.add_argument("-p", "--padding", type=float, default=0.0,
+        help="amount of padding to add to each border of ROI")
+    ap.add_argument("-i", "--input", type=str, default="build/images/test3/frame0.png", help="Input image path")
+    ap.add_argument("-o", "--output", type=str, default="screenshots/test2.png", help="Output image path")
+    args = vars(ap.parse_args())
+
+    process_one_image(args["input"], args["output"], args["east"], (args["height"], args["width"]), 
+        args["min_confidence"], args["padding"])
\ No newline at end of file
@@ -6,12 +6,18 @@ __status__ = "Development"
 __date__ = "05/2019"
 __license__ = "MIT"
 
-import cv2, pytesseract, imutils, logging
+import re, cv2, pytesseract, imutils, logging
 import numpy as np
 
 from skimage.measure import compare_ssim as ssim
 
 from consts import *
+import profile_helpers
+
+# number of recognized ROI texts kept per recording
+TEXT_CACHE_SIZE = 4096
+# maximum share of different pixels for an ROI to reuse cached text
+TEXT_CACHE_TOLERANCE = 0.02
 
 logger = logging.getLogger('')
 def sort_contours(cnts, method="left-to-right"):
@@ -34,6 +40,20 @@ def sort_contours(cnts, method="left-to-right"):
     (cnts, boundingBoxes) = zip(*sorted(zip(cnts, boundingBoxes), key=lambda b:b[1][i], reverse=reverse))
     return (cnts, boundingBoxes)
 
+def to_gray(image):
+    """Convert BGR image to grayscale, grayscale image is returned as is
+    
+    Arguments:
+        image {cv2.image} -- cv2 image
+    
+    Returns:
+        cv2.image -- grayscale image
+    """
+    if len(image.shape) == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+@profile_helpers.timed("preprocess_image")
 def preprocess_image(image):
     """Preprocess image for better contours detection
     Transofrm text blocks into almost rectangles
@@ -44,9 +64,7 @@ def preprocess_image(image):
     Returns:
         cv2.image -- Processed CV2 image object
     """
-    new_image = image.copy()
-
-    new_image = cv2.cvtColor(new_image, cv2.COLOR_BGR2GRAY)
+    new_image = to_gray(image)
     new_image = cv2.GaussianBlur(new_image,(15,15), 0)
     ret3, new_image = cv2.threshold(new_image,0,255,cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
     # _, new_image = cv2.threshold(new_image, 0, 255, cv2.THRESH_BINARY_INV)
@@ -54,12 +72,32 @@ def preprocess_image(image):
     new_image = cv2.dilate(new_image, kernel, iterations = 3)
     return new_image
     
+def memoize_roi(roi_cache, key, func, *args):
+    """Compute func(*args) once for the same ROI and parameters of a frame
+    
+    Arguments:
+        roi_cache {dict} -- per frame cache, nothing is cached if None
+        key {tuple} -- ROI position and parameters, nothing is cached if None
+        func {function} -- function to compute the value
+    
+    Returns:
+        object -- func(*args)
+    """
+    if roi_cache is None or key is None:
+        return func(*args)
+    if key not in roi_cache:
+        roi_cache[key] = func(*args)
+    return roi_cache[key]
+
+def roi_key(roi_id, *params):
+    return None if roi_id is None else (roi_id,) + params
+
 def preprocess_roi(image, padding=0, scaling_factor=1):
     """Processes image for beter text detection witht Google Tesseract
     Based on: https://docs.opencv.org/3.4.0/d7/d4d/tutorial_py_thresholding.html
     
     Arguments:
-        image {cv2.image} -- cv2 image
+        image {cv2.image} -- cv2 image, BGR or grayscale
     
     Keyword Arguments:
         padding {int} -- padding from all image sides (default: {0})
@@ -68,13 +106,105 @@ def preprocess_roi(image, padding=0, scaling_factor=1):
     Returns:
         cv2.image -- processed cv2 image object
     """
-    roi = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    roi = to_gray(image)
+    # ROIs of a frame are processed one by one, resizing them stacked in one image gives the same result
+    # but is not faster, the time goes to pixels and not to calls
     roi = cv2.resize(roi, (image.shape[:2][1]*scaling_factor, image.shape[:2][0]*scaling_factor), interpolation=cv2.INTER_CUBIC)
     blur = cv2.GaussianBlur(roi,(3,3),0)
     _,roi = cv2.threshold(blur,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
     roi = cv2.copyMakeBorder(roi, padding, padding, padding, padding, cv2.BORDER_CONSTANT, value=(255,255,255))
     return roi
 
+def roi_fingerprint(image, size=(96, 24)):
+    """Binarize image, crop it to the text and resize to a fixed size,
+    so images of the same text can be compared pixel by pixel
+    
+    Arguments:
+        image {cv2.image} -- cv2 image
+    
+    Keyword Arguments:
+        size {tuple} -- fingerprint (width, height) (default: {(96, 24)})
+    
+    Returns:
+        np.array -- boolean array, True for text pixels
+    """
+    roi = crop_text(image)
+    if roi is None:
+        return np.zeros((size[1], size[0]), bool)
+    roi = cv2.resize(roi, size, interpolation=cv2.INTER_AREA)
+    return roi > 127
+
+def crop_text(image):
+    """Binarize image with text in white and crop it to the text
+    
+    Arguments:
+        image {cv2.image} -- cv2 image, BGR or grayscale
+    
+    Returns:
+        cv2.image -- binarized image, None if there is no text
+    """
+    roi = to_gray(image)
+    _, roi = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
+    (x, y, w, h) = cv2.boundingRect(roi)
+    if w == 0 or h == 0:
+        return None
+    return roi[y:y + h, x:x + w]
+
+def text_cache_key(image, height=8):
+    """Get key and fingerprint to look up recognized text of an ROI,
+    the key is a coarse picture of the text keeping its aspect ratio, 
+    the fingerprint is compared to tell apart similar texts with the same key
+    
+    Arguments:
+        image {cv2.image} -- cv2 image of the ROI
+    
+    Keyword Arguments:
+        height {int} -- height of the coarse picture (default: {8})
+    
+    Returns:
+        (tuple, np.array) -- (key, fingerprint)
+    """
+    roi = crop_text(image)
+    if roi is None:
+        return (0, 0, b""), np.zeros((24, 96), bool)
+    width = max(1, int(round(height*roi.shape[1]/roi.shape[0])))
+    coarse = cv2.resize(roi, (width, height), interpolation=cv2.INTER_AREA) > 127
+    fingerprint = cv2.resize(roi, (96, 24), interpolation=cv2.INTER_AREA) > 127
+    return (width, height, np.packbits(coarse).tobytes()), fingerprint
+
+def get_cached_text(text_cache, key, fingerprint):
+    """Get text recognized before on a similar ROI
+    
+    Arguments:
+        text_cache {OrderedDict} -- key to (fingerprint, text)
+        key {tuple} -- key from text_cache_key with recognition settings
+        fingerprint {np.array} -- fingerprint from text_cache_key
+    
+    Returns:
+        str -- text, None if not found
+    """
+    entry = text_cache.get(key)
+    if entry is None or np.mean(entry[0] != fingerprint) > TEXT_CACHE_TOLERANCE:
+        return None
+    text_cache.move_to_end(key)
+    return entry[1]
+
+def put_cached_text(text_cache, key, fingerprint, text):
+    """Store recognized text, the least recently used text is dropped
+    if there are more than TEXT_CACHE_SIZE
+    
+    Arguments:
+        text_cache {OrderedDict} -- key to (fingerprint, text)
+        key {tuple} -- key from text_cache_key with recognition settings
+        fingerprint {np.array} -- fingerprint from text_cache_key
+        text {str} -- recognized text
+    """
+    text_cache[key] = (fingerprint, text)
+    text_cache.move_to_end(key)
+    if len(text_cache) > TEXT_CACHE_SIZE:
+        text_cache.popitem(last=False)
+
+@profile_helpers.timed("find_countours")
 def find_countours(image):
     """Get contours on the image
     
@@ -107,6 +237,60 @@ def draw_countrous(image, cntrs):
         cv2.rectangle(out_image, (x, y), (x + w, y + h), (0, 255, 0), 2)
     return out_image
 
+def get_boxes(cntrs):
+    """Get bounding boxes of contours
+    
+    Arguments:
+        cntrs {list} -- contours
+    
+    Returns:
+        list -- list of (x, y, w, h) tuples
+    """
+    return [cv2.boundingRect(c) for c in cntrs]
+
+def align_boxes(boxes, width, margin=0.25):
+    """Make boxes of the key (left) and the value (right) column equally wide
+    and add vertical margin, so boxes found on one frame fit text on other frames
+    with the same layout, e.g. when rows changed their order
+    
+    Arguments:
+        boxes {list} -- list of (x, y, w, h) tuples
+        width {int} -- image width
+    
+    Keyword Arguments:
+        margin {float} -- vertical margin relative to the highest box of the column (default: {0.25})
+    
+    Returns:
+        list -- list of (x, y, w, h) tuples
+    """
+    left = [b for b in boxes if b[0] < width/4 and b[0] + b[2] <= width/2]
+    right = [b for b in boxes if b[0] >= width/4 and b[0] + b[2] > width/2]
+    aligned = []
+    for b in boxes:
+        group = left if b in left else right if b in right else [b]
+        x1 = min(g[0] for g in group)
+        x2 = max(g[0] + g[2] for g in group)
+        dy = int(max(g[3] for g in group)*margin)
+        y = max(0, b[1] - dy)
+        aligned.append((x1, y, x2 - x1, b[1] + b[3] + dy - y))
+    return aligned
+
+def crop_rois(image, boxes):
+    """Extract regions of interest from the image by bounding boxes
+    
+    Arguments:
+        image {cv2.image} -- cv2 image object
+        boxes {list} -- list of (x, y, w, h) tuples
+    
+    Returns:
+        list --  list of (cv2 image, (y1, y2, x1, x2)) tuples
+    """
+    rois = []
+    for (x, y, w, h) in boxes:
+        roi = image[y:y + h, x:x + w]
+        rois.append((roi, (y, y + h, x, x+w)))
+    return rois
+
 def get_rois(image, cntrs):
     """Extract regions of interestt from the image based on contours
     Original image shall be provided
@@ -118,14 +302,182 @@ def get_rois(image, cntrs):
     Returns:
         list --  list of cv2 images
     """
-    rois = []
-    for c in cntrs:
-        (x, y, w, h) = cv2.boundingRect(c)
-        roi = image[y:y + h, x:x + w]
-        rois.append((roi, (y, y + h, x, x+w)))
-    return rois
+    return crop_rois(image, get_boxes(cntrs))
+
+class PytesseractEngine:
+    """Google Tesseract called with pytesseract, every call starts a new process"""
+
+    @profile_helpers.timed("ocr")
+    def image_to_string(self, image, config=TESSERACT_CONF):
+        return pytesseract.image_to_string(image, config=config)
+
+    @profile_helpers.timed("ocr_batch")
+    def image_to_data(self, image, config=TESSERACT_BATCH_CONF):
+        """Recognize words on the image
+        
+        Arguments:
+            image {cv2.image} -- binarized cv2 image
+        
+        Keyword Arguments:
+            config {str} -- Tesseract config (default: {TESSERACT_BATCH_CONF})
+        
+        Returns:
+            dict -- lists "text", "left", "top", "width", "height" for every word
+        """
+        return pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+
+class TesserocrEngine:
+    """Google Tesseract API used in process with tesserocr,
+    the model is loaded once and reused for every image"""
+
+    def __init__(self, lang="eng"):
+        import tesserocr
+        self.tesserocr = tesserocr
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    def set_image(self, image, config):
+        psm = re.search(r"--psm\s+(\d+)", config)
+        if psm is not None:
+            self.api.SetPageSegMode(int(psm.group(1)))
+        image = np.ascontiguousarray(image)
+        self.api.SetImageBytes(image.tobytes(), image.shape[1], image.shape[0], 1, image.shape[1])
+
+    @profile_helpers.timed("ocr")
+    def image_to_string(self, image, config=TESSERACT_CONF):
+        self.set_image(image, config)
+        return self.api.GetUTF8Text().strip()
 
-def recognise_rois(rois, padding=0, scaling_factor=1, debug=False):
+    @profile_helpers.timed("ocr_batch")
+    def image_to_data(self, image, config=TESSERACT_BATCH_CONF):
+        self.set_image(image, config)
+        self.api.Recognize()
+        data = {"text": [], "left": [], "top": [], "width": [], "height": []}
+        iterator = self.api.GetIterator()
+        if iterator is None:
+            return data
+        level = self.tesserocr.RIL.WORD
+        for r in self.tesserocr.iterate_level(iterator, level):
+            box = r.BoundingBox(level)
+            if box is None:
+                continue
+            data["text"].append(r.GetUTF8Text(level))
+            data["left"].append(box[0])
+            data["top"].append(box[1])
+            data["width"].append(box[2] - box[0])
+            data["height"].append(box[3] - box[1])
+        return data
+
+OCR_ENGINES = {
+    "pytesseract": PytesseractEngine,
+    "tesserocr": TesserocrEngine
+}
+
+# engines created in this process
+_ocr_engines = {}
+
+class ContourDetector:
+    """Text blocks found as contours of preprocess_image"""
+
+    def detect(self, image):
+        return get_boxes(find_countours(preprocess_image(image)))
+
+    def detect_batch(self, images):
+        return [self.detect(image) for image in images]
+
+def create_east_detector():
+    import cv2detection_try
+    return cv2detection_try.EastDetector()
+
+TEXT_DETECTORS = {
+    "contours": ContourDetector,
+    "east": create_east_detector
+}
+
+# text detectors created in this process
+_text_detectors = {}
+
+def get_text_detector(name=DEFAULT_TEXT_DETECTOR):
+    """Get text detector by name, every detector is created once per process
+    
+    Keyword Arguments:
+        name {str} -- key of TEXT_DETECTORS (default: {DEFAULT_TEXT_DETECTOR})
+    
+    Returns:
+        object -- detector with detect method returning (x, y, w, h) boxes from top to bottom
+    """
+    if name not in _text_detectors:
+        _text_detectors[name] = TEXT_DETECTORS[name]()
+    return _text_detectors[name]
+
+def get_ocr_engine(name=DEFAULT_OCR_ENGINE):
+    """Get OCR engine by name, every engine is created once per process
+    
+    Keyword Arguments:
+        name {str} -- key of OCR_ENGINES (default: {DEFAULT_OCR_ENGINE})
+    
+    Returns:
+        object -- engine with image_to_string and image_to_data methods
+    """
+    if name not in _ocr_engines:
+        _ocr_engines[name] = OCR_ENGINES[name]()
+    return _ocr_engines[name]
+
+def compose_images(images, gap=None):
+    """Stack binarized images into one white page, one image per line
+    
+    Arguments:
+        images {list} -- list of binarized cv2 images
+    
+    Keyword Arguments:
+        gap {int} -- vertical space between images, max image height if None (default: {None})
+    
+    Returns:
+        (cv2.image, list) -- (page, upper bound of every line on the page)
+    """
+    if gap is None:
+        gap = max(i.shape[0] for i in images)
+    width = max(i.shape[1] for i in images) + 2*gap
+    height = sum(i.shape[0] for i in images) + gap*(len(images) + 1)
+    page = np.full((height, width), 255, np.uint8)
+    bounds = []
+    y = gap
+    for i in images:
+        page[y:y + i.shape[0], gap:gap + i.shape[1]] = i
+        y += i.shape[0] + gap
+        # words are assigned to the line if their center is above the middle of the next gap
+        bounds.append(y - gap//2)
+    return page, bounds
+
+def recognise_images_batch(images, engine=DEFAULT_OCR_ENGINE):
+    """Recognize text on several images with one Tesseract call,
+    images are stacked into one page and words are mapped back by their position
+    
+    Arguments:
+        images {list} -- list of binarized cv2 images
+    
+    Keyword Arguments:
+        engine {str} -- OCR engine name (default: {DEFAULT_OCR_ENGINE})
+    
+    Returns:
+        list -- text for every image
+    """
+    if len(images) == 0:
+        return []
+    page, bounds = compose_images(images)
+    data = get_ocr_engine(engine).image_to_data(page, config=TESSERACT_BATCH_CONF)
+    words = [[] for i in images]
+    for i in range(len(data["text"])):
+        text = str(data["text"][i]).strip()
+        if len(text) == 0:
+            continue
+        center = data["top"][i] + data["height"][i]/2
+        line = min(int(np.searchsorted(bounds, center)), len(images) - 1)
+        words[line].append((data["left"][i], text))
+    return [" ".join(w for _, w in sorted(line)) for line in words]
+
+@profile_helpers.timed("recognise_rois")
+def recognise_rois(rois, padding=0, scaling_factor=1, debug=False, batch=False, engine=DEFAULT_OCR_ENGINE, trigger=True,
+        text_cache=None, roi_cache=None):
     """Recognize text on the image roi with Goolge Tesseract
     
     Arguments:
@@ -135,19 +487,27 @@ def recognise_rois(rois, padding=0, scaling_factor=1, debug=False):
         padding {int} -- padding from all  four sides of the image (default: {0})
         scaling_factor {int} -- rescaling factor to resize image (default: {1})
         debug {bool} -- enable debug output (default: {False})
+        batch {bool} -- recognize all ROIs with one Tesseract call (default: {False})
+        engine {str} -- OCR engine name, key of OCR_ENGINES (default: {DEFAULT_OCR_ENGINE})
+        trigger {bool} -- skip ROIs until TRIGGER_WORD is found, otherwise return all ROIs (default: {True})
+        text_cache {OrderedDict} -- reuse text of ROIs which look like ROIs recognized before (default: {None})
+        roi_cache {dict} -- per frame cache of processed ROIs, positions of rois are their ids (default: {None})
     
     Returns:
         list -- text on the image as list
     """
+    if batch:
+        recognised = recognise_rois_batch(rois, padding, scaling_factor, engine, text_cache, roi_cache)
+    else:
+        # lazy, so nothing is recognized after all values are found
+        recognised = (recognise_roi(r, padding, scaling_factor, engine, text_cache, roi_cache, p) for r, p in rois)
     values = []
-    triggered = False
-    for i in range(len(rois)):
-        r, pos = rois[i]
-        image = preprocess_roi(r, padding, scaling_factor)
-        text = pytesseract.image_to_string(image, config=TESSERACT_CONF)
+    triggered = not trigger
+    for i, (image, text) in enumerate(recognised):
+        _, pos = rois[i]
         if triggered:
             logger.debug("ROI {}: {}".format(i, text))
-            if debug:
+            if debug and image is not None:
                 cv2.imwrite("%s/%d.png"%(DEBUG_FOLDER,i), image)
             values.append((text, pos))
             if len(values) == len(EXPECTED_KEYS)*2:
@@ -157,6 +517,130 @@ def recognise_rois(rois, padding=0, scaling_factor=1, debug=False):
         logger.warning("Trigger not found")
     return values
 
+def recognise_roi(roi, padding=0, scaling_factor=1, engine=DEFAULT_OCR_ENGINE, text_cache=None, roi_cache=None, roi_id=None):
+    """Recognize text on one ROI, looking it up in text_cache first
+    
+    Arguments:
+        roi {cv2.image} -- cv2 image of the ROI
+    
+    Keyword Arguments:
+        padding {int} -- padding from all  four sides of the image (default: {0})
+        scaling_factor {int} -- rescaling factor to resize image (default: {1})
+        engine {str} -- OCR engine name, key of OCR_ENGINES (default: {DEFAULT_OCR_ENGINE})
+        text_cache {OrderedDict} -- cache of recognized texts (default: {None})
+        roi_cache {dict} -- per frame cache of processed ROIs (default: {None})
+        roi_id {tuple} -- position of the ROI in the frame, key in roi_cache (default: {None})
+    
+    Returns:
+        (cv2.image, str) -- (processed image, None if text is cached; text)
+    """
+    if text_cache is not None:
+        key, fingerprint = memoize_roi(roi_cache, roi_key(roi_id, "text"), text_cache_key, roi)
+        key = (padding, scaling_factor, engine) + key
+        text = get_cached_text(text_cache, key, fingerprint)
+        if text is not None:
+            return None, text
+    image = memoize_roi(roi_cache, roi_key(roi_id, "image", padding, scaling_factor), preprocess_roi, 
+        roi, padding, scaling_factor)
+    text = get_ocr_engine(engine).image_to_string(image, config=TESSERACT_CONF)
+    if text_cache is not None:
+        put_cached_text(text_cache, key, fingerprint, text)
+    return image, text
+
+def recognise_rois_batch(rois, padding=0, scaling_factor=1, engine=DEFAULT_OCR_ENGINE, text_cache=None, roi_cache=None):
+    """Recognize text on all ROIs with one Tesseract call,
+    ROIs found in text_cache are not recognized again
+    
+    Arguments:
+        rois {list} -- list of (cv2 image, position) tuples
+    
+    Keyword Arguments:
+        padding {int} -- padding from all  four sides of the image (default: {0})
+        scaling_factor {int} -- rescaling factor to resize image (default: {1})
+        engine {str} -- OCR engine name, key of OCR_ENGINES (default: {DEFAULT_OCR_ENGINE})
+        text_cache {OrderedDict} -- cache of recognized texts (default: {None})
+        roi_cache {dict} -- per frame cache of processed ROIs, positions of rois are their ids (default: {None})
+    
+    Returns:
+        list -- list of (processed image, None if text is cached; text) tuples
+    """
+    images = [None]*len(rois)
+    texts = [None]*len(rois)
+    keys = [None]*len(rois)
+    for i, (r, p) in enumerate(rois):
+        if text_cache is not None:
+            key, fingerprint = memoize_roi(roi_cache, roi_key(p, "text"), text_cache_key, r)
+            keys[i] = ((padding, scaling_factor, engine) + key, fingerprint)
+            texts[i] = get_cached_text(text_cache, *keys[i])
+        if texts[i] is None:
+            images[i] = memoize_roi(roi_cache, roi_key(p, "image", padding, scaling_factor), preprocess_roi, 
+                r, padding, scaling_factor)
+    missing = [i for i in range(len(rois)) if texts[i] is None]
+    for i, text in zip(missing, recognise_images_batch([images[i] for i in missing], engine)):
+        texts[i] = text
+        if text_cache is not None:
+            put_cached_text(text_cache, keys[i][0], keys[i][1], text)
+    return list(zip(images, texts))
+
+def prepare_color(image):
+    return image
+
+def prepare_gray_small(image, scale=0.25):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def prepare_value_column(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return gray[:, gray.shape[1]//2:]
+
+def prepare_phash(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(np.float32(gray))[:8, :8]
+    return dct > np.median(dct)
+
+def compare_ssim_color(a, b):
+    return ssim(a, b, multichannel=True)
+
+def compare_ssim_gray(a, b):
+    return ssim(a, b)
+
+def compare_mad(a, b):
+    return 1 - cv2.absdiff(a, b).mean()/255
+
+def compare_hash(a, b):
+    return 1 - np.mean(a != b)
+
+# Ways to compare video frames, "prepare" is called once per frame, "compare" returns similarity
+# of prepared frames, frames with similarity below "tolerance" are kept.
+# Tolerances of "ssim-gray" give the same frames as "ssim" on the sample video.
+FRAME_SIMILARITY = {
+    "ssim": {
+        "prepare": prepare_color,
+        "compare": compare_ssim_color,
+        "tolerance": 0.98,
+        "middle_tolerance": 0.7
+    },
+    "ssim-gray": {
+        "prepare": prepare_gray_small,
+        "compare": compare_ssim_gray,
+        "tolerance": 0.967,
+        "middle_tolerance": 0.7
+    },
+    "mad": {
+        "prepare": prepare_value_column,
+        "compare": compare_mad,
+        "tolerance": 0.994,
+        "middle_tolerance": 0.9
+    },
+    "phash": {
+        "prepare": prepare_phash,
+        "compare": compare_hash,
+        "tolerance": 1.0,
+        "middle_tolerance": 0.7
+    }
+}
+
 def get_video_n_frames(filename):
     vidcap = cv2.VideoCapture(filename)
     n_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -175,46 +659,199 @@ def get_video_frame(filename, frame_n):
     vidcap.release()
     return frame_n, frame
 
-def get_video_frames(filename, output="images", frames=None, middle_frame=None, tolerance=0.98, middle_tolerance=0.7):
-    """Get individual frames from the video file, skipping images which
-    are similar by structurual similarity (SSIM) by more than tolerance
+def read_frames_seeking(vidcap, frames):
+    """Read frames by seeking to every frame number
+    Each seek makes the decoder go back to the previous keyframe
+
+    Arguments:
+        vidcap {cv2.VideoCapture} -- opened video capture
+        frames {list} -- frame numbers to read
+
+    Yields:
+        (int, cv2.image) -- (frame number, image), image is None if reading failed
+    """
+    for f in frames:
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES,f)
+        success, image = vidcap.read()
+        yield f, image if success else None
+
+def seek_keyframe(vidcap, frame, index):
+    """Seek to the last keyframe not after the frame and grab the frame where the decoder lands.
+    OpenCV lands on wrong frames in variable frame rate videos, so the landing frame is found 
+    by its timestamp in the packet index. If it is after the frame, the previous keyframe is tried
+
+    Arguments:
+        vidcap {cv2.VideoCapture} -- opened video capture
+        frame {int} -- frame number to reach
+        index {dict} -- packet index from get_video_keyframes
+
+    Returns:
+        int -- number of the grabbed frame, not after frame, None if no keyframe but the first one works
+    """
+    positions = index.get("positions")
+    if positions is None:
+        positions = index["positions"] = dict((round(t, 3), i) for i, t in enumerate(index["timestamps"]))
+    for k in sorted((k for k in index["keyframes"] if 0 < k <= frame), reverse=True):
+        vidcap.set(cv2.CAP_PROP_POS_MSEC, index["timestamps"][k])
+        if not vidcap.grab():
+            continue
+        landed = positions.get(round(vidcap.get(cv2.CAP_PROP_POS_MSEC), 3))
+        if landed is not None and landed <= frame:
+            return landed
+    return None
+
+def read_frames_sequential(vidcap, frames, seek=True, index=None):
+    """Read frames decoding the stream once, frames which are not requested
+    are only grabbed and never converted to images
+
+    Arguments:
+        vidcap {cv2.VideoCapture} -- opened video capture
+        frames {list} -- frame numbers to read
+
+    Keyword Arguments:
+        seek {bool} -- seek to the first frame by its number, seeking is exact only 
+            for constant frame rate videos (default: {True})
+        index {dict} -- packet index from get_video_keyframes, if seek is False decoding starts 
+            at a keyframe before the first frame, see seek_keyframe, otherwise at the beginning (default: {None})
+
+    Yields:
+        (int, cv2.image) -- (frame number, image), image is None if reading failed
+    """
+    frames = sorted(set(frames))
+    if len(frames) == 0:
+        return
+    pos = 0
+    grabbed = False
+    if seek and frames[0] > 0:
+        pos = frames[0]
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES,pos)
+    elif index is not None and frames[0] > 0:
+        landed = seek_keyframe(vidcap, frames[0], index)
+        if landed is not None:
+            pos = landed
+            grabbed = True
+        else:
+            logger.warning("Could not seek before frame %d, decoding from the beginning"%frames[0])
+            vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    idx = 0
+    while idx < len(frames):
+        if not grabbed and not vidcap.grab():
+            break
+        grabbed = False
+        if pos == frames[idx]:
+            success, image = vidcap.retrieve()
+            yield pos, image if success else None
+            idx += 1
+        pos += 1
+    # end of the stream reached before all frames were read
+    for f in frames[idx:]:
+        yield f, None
+
+def get_video_keyframes(filename):
+    """Find keyframes by reading packets of the video stream without decoding them,
+    packets are in decoding order, frames are numbered in order of their timestamps
+
+    Arguments:
+        filename {str} -- path to video file
+
+    Returns:
+        dict -- packet index, "keyframes" frame numbers of keyframes and "timestamps" 
+            in ms of every frame, None if packets can not be read
+    """
+    # older OpenCV versions can not read raw packets
+    if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+        return None
+    vidcap = cv2.VideoCapture(filename)
+    try:
+        if not vidcap.set(cv2.CAP_PROP_FORMAT, -1):
+            return None
+        packets = []
+        while vidcap.grab():
+            packets.append((vidcap.get(cv2.CAP_PROP_POS_MSEC), bool(vidcap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME))))
+    finally:
+        vidcap.release()
+    timestamps = sorted(t for t, _ in packets)
+    keyframes = sorted(int(np.searchsorted(timestamps, t)) for t, key in packets if key)
+    if len(keyframes) == 0:
+        return None
+    return {"keyframes": keyframes, "timestamps": timestamps}
+
+def split_video_segments(frames, n, keyframes=None):
+    """Split frame numbers to at most n contiguous segments, 
+    every segment starts at the first frame after the keyframe nearest to an even split
+
+    Arguments:
+        frames {list} -- sorted frame numbers to read
+        n {int} -- number of segments
+
+    Keyword Arguments:
+        keyframes {list} -- frame numbers of keyframes, even split if None (default: {None})
+
+    Returns:
+        list -- (first, last) index of frames for every segment, last is not included
+    """
+    starts = set([0])
+    for i in range(1, n):
+        target = frames[i*len(frames)//n]
+        if keyframes is not None:
+            target = min(keyframes, key=lambda k: abs(k - target))
+        starts.add(int(np.searchsorted(frames, target)))
+    starts = sorted(s for s in starts if s < len(frames))
+    return list(zip(starts, starts[1:] + [len(frames)]))
+
+def iter_video_frames(filename, frames=None, middle_frame=None, tolerance=None, middle_tolerance=None, sequential=True,
+        similarity=DEFAULT_FRAME_SIMILARITY):
+    """Iterate over individual frames from the video file, skipping images which
+    are similar by more than tolerance
     
     Arguments:
         filename {str} -- path to video file
     
     Keyword Arguments:
-        output {str} -- output folder path (default: {"images"})
-        tolerance {float} -- tolerance to skip similar images (default: {0.98})
+        frames {list} -- frame numbers to read, all frames if None (default: {None})
+        middle_frame {cv2.image} -- reference frame, frames not similar to it are skipped (default: {None})
+        tolerance {float} -- tolerance to skip similar images, default of similarity if None (default: {None})
+        middle_tolerance {float} -- tolerance to skip images not similar to middle_frame, 
+            default of similarity if None (default: {None})
+        sequential {bool} -- decode the stream once instead of seeking to every frame (default: {True})
+        similarity {str} -- way to compare frames, key of FRAME_SIMILARITY (default: {DEFAULT_FRAME_SIMILARITY})
     
-    Returns:
-        (int, list) -- (number frames, file names)
+    Yields:
+        (int, cv2.image) -- (frame number, image) of kept frames
     """
+    method = FRAME_SIMILARITY[similarity]
+    if tolerance is None:
+        tolerance = method["tolerance"]
+    if middle_tolerance is None:
+        middle_tolerance = method["middle_tolerance"]
+    if middle_frame is not None:
+        middle_frame = method["prepare"](middle_frame)
     simple_read = False
     if frames is None:
         n_frames, _ = get_video_n_frames(filename)
         frames = range(n_frames)
         simple_read = True
     vidcap = cv2.VideoCapture(filename)
+    if simple_read:
+        reader = ((f, vidcap.read()[1]) for f in frames)
+    elif sequential:
+        reader = read_frames_sequential(vidcap, frames)
+    else:
+        reader = read_frames_seeking(vidcap, frames)
     last_image = None
-    frame_list = []
-    count = 0
-    for f in frames:
-        save_fn = "%s/frame%d.png"%(output,f)
-        if not simple_read:
-            vidcap.set(cv2.CAP_PROP_POS_FRAMES,f)
-        success, image = vidcap.read()
-        if not success:
-            if simple_read:
-                break
-            else: 
-                logger.warning("Failed reading frame %d"%f)
+    try:
+        for f, image in reader:
+            if image is None:
+                if simple_read:
+                    break
+                else: 
+                    logger.warning("Failed reading frame %d"%f)
+                    continue
+            prepared = method["prepare"](image)
+            if middle_frame is not None and method["compare"](middle_frame, prepared) < middle_tolerance:
                 continue
-        if middle_frame is not None and ssim(middle_frame, image, multichannel=True) < middle_tolerance:
-            continue
-        if last_image is None or ssim(last_image, image, multichannel=True) < tolerance:
-            frame_list.append(save_fn)
-            count += 1
-            cv2.imwrite(save_fn, image) 
-            last_image = image.copy()
-    vidcap.release()
-    return count, frame_list
\ No newline at end of file
+            if last_image is None or method["compare"](last_image, prepared) < tolerance:
+                last_image = prepared.copy()
+                yield f, image
+    finally:
+        vidcap.release()
@@ -0,0 +1,191 @@
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import os, json, logging, importlib.util
+import numpy as np
+import multiprocessing as mp
+
+logger = logging.getLogger('')
+
+# file extension of frame caches, the index is next to it with INDEX_EXTENSION instead
+FRAME_CACHE_EXTENSION = ".frames.npy"
+INDEX_EXTENSION = ".frames.json"
+
+# folder of POSIX shared memory, checked for free space before a ring is created
+SHM_FOLDER = "/dev/shm"
+
+def is_frame_cache(path):
+    return path.endswith(FRAME_CACHE_EXTENSION)
+
+def index_path(path):
+    return path[:-len(FRAME_CACHE_EXTENSION)] + INDEX_EXTENSION
+
+def frame_name(folder, frame):
+    """Name of a frame, the same as the path of its PNG file, so results and stored results
+    of frames from the cache and from the folder are named alike"""
+    return "%s/frame%d.png"%(folder, frame)
+
+def create_frame_cache(path, folder, frames, shape):
+    """Preallocate the array file with one slot for every frame which may be kept,
+    slots which are never written take no disk space on file systems with sparse files
+
+    Arguments:
+        path {str} -- path to the cache file, ends with FRAME_CACHE_EXTENSION
+        folder {str} -- folder of frame names, see frame_name
+        frames {list} -- frame numbers which may be kept
+        shape {tuple} -- shape of a BGR frame
+
+    Returns:
+        FrameCache -- cache opened for writing, no frame is kept yet
+    """
+    np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(len(frames),) + tuple(shape)).flush()
+    with open(index_path(path), "w") as f:
+        json.dump({"folder": folder, "frames": list(frames), "kept": []}, f)
+    return FrameCache(path, "r+")
+
+class FrameCache:
+    """Frames of a video in one memory-mapped uint8 array of N x H x W x 3, slot i holds
+    frame frames[i] of the index file, the index lists kept frames in order.
+    Frames are read without copy and without decoding, several processes may write different slots
+    """
+
+    def __init__(self, path, mode="r"):
+        """Open cache file and its index
+
+        Arguments:
+            path {str} -- path to the cache file
+
+        Keyword Arguments:
+            mode {str} -- numpy.load mmap_mode, "r+" to write frames (default: {"r"})
+        """
+        self.path = path
+        with open(index_path(path)) as f:
+            self.index = json.load(f)
+        self.images = np.load(path, mmap_mode=mode)
+        self._slots = dict((f, i) for i, f in enumerate(self.index["frames"]))
+        self._names = dict((frame_name(self.index["folder"], f), f) for f in self.index["kept"])
+
+    def names(self):
+        """Names of kept frames in order
+
+        Returns:
+            list -- frame names
+        """
+        return [frame_name(self.index["folder"], f) for f in self.index["kept"]]
+
+    def image(self, name):
+        """Read-only view of a kept frame
+
+        Arguments:
+            name {str} -- frame name
+
+        Returns:
+            cv2.image -- BGR image
+        """
+        return self.images[self._slots[self._names[name]]]
+
+    def write(self, frame, image):
+        self.images[self._slots[frame]] = image
+
+    def flush(self):
+        self.images.flush()
+
+    def set_kept(self, kept):
+        """Write frames which are kept to the index, written slots are flushed before
+
+        Arguments:
+            kept {list} -- frame numbers in order
+        """
+        self.flush()
+        self.index["kept"] = list(kept)
+        self._names = dict((frame_name(self.index["folder"], f), f) for f in kept)
+        tmp_path = index_path(self.path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, index_path(self.path))
+
+def shared_memory_available(size):
+    """Check free space for shared memory, writing beyond the size of /dev/shm 
+    kills the writing process with SIGBUS instead of raising an error
+
+    Arguments:
+        size {int} -- size in bytes
+
+    Returns:
+        bool -- False if there is not enough space or shared memory is not supported, it needs Python 3.8
+    """
+    # multiprocessing.shared_memory is new in Python 3.8
+    if importlib.util.find_spec("multiprocessing.shared_memory") is None:
+        return False
+    if not os.path.isdir(SHM_FOLDER):
+        return True
+    st = os.statvfs(SHM_FOLDER)
+    return st.f_bavail*st.f_frsize >= size
+
+class FrameRing:
+    """Fixed number of frame slots in shared memory. The writer copies a frame into a free slot
+    and sends only the slot number, the reader uses the frame in place and puts the slot 
+    back to the queue of free slots, which limits the number of frames in flight.
+    Created by the parent process, inherited or pickled as argument of child processes
+    """
+
+    def __init__(self, n_slots, shape, name=None, free_q=None):
+        """Create shared memory with all slots free or attach to existing one
+
+        Arguments:
+            n_slots {int} -- number of slots
+            shape {tuple} -- shape of a BGR frame
+
+        Keyword Arguments:
+            name {str} -- name of existing shared memory, new one is created if None (default: {None})
+            free_q {mp.Queue} -- queue of free slots of existing shared memory (default: {None})
+        """
+        # multiprocessing.shared_memory is new in Python 3.8
+        from multiprocessing import shared_memory
+        self.n_slots = n_slots
+        self.shape = tuple(shape)
+        self.frame_size = int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=n_slots*self.frame_size)
+        self.free_q = mp.Queue() if free_q is None else free_q
+        if name is None:
+            for i in range(n_slots):
+                self.free_q.put(i)
+
+    def __reduce__(self):
+        return (FrameRing, (self.n_slots, self.shape, self.shm.name, self.free_q))
+
+    def view(self, slot):
+        return np.ndarray(self.shape, np.uint8, buffer=self.shm.buf, offset=slot*self.frame_size)
+
+    def put(self, image):
+        """Copy frame into the next free slot, waits until a slot is released
+
+        Arguments:
+            image {cv2.image} -- BGR image
+
+        Returns:
+            int -- slot number, None if the image does not fit the slots
+        """
+        if image.shape != self.shape or image.dtype != np.uint8:
+            return None
+        slot = self.free_q.get()
+        self.view(slot)[:] = image
+        return slot
+
+    def release(self, slot):
+        self.free_q.put(slot)
+
+    def close(self, unlink=False):
+        """Detach from shared memory, views of slots must not be used afterwards
+
+        Keyword Arguments:
+            unlink {bool} -- remove shared memory, done once by the creating process (default: {False})
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
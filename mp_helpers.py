@@ -0,0 +1,1199 @@
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import os, math, time, queue, logging
+import multiprocessing as mp
+import numpy as np
+import cv2, pytesseract
+
+import recognizer, cv_helpers, consts, store_helpers, profile_helpers, frame_helpers
+
+logger = logging.getLogger('')
+
+# seconds between progress messages
+PROGRESS_INTERVAL = 10
+
+# seconds between checks for pool workers which died
+WORKER_CHECK_INTERVAL = 1
+
+# times a task lost with a dead worker is submitted again
+MAX_TASK_RETRIES = 1
+
+# per process recognition settings, filled by init_worker
+_worker = {}
+
+def init_worker(padding=0, scaling_factor=1, debug=False, options=None, profile=None, detect_batch=1,
+        frame_cache=None, started_q=None, store=None):
+    """Prepare worker process once: store recognition settings,
+    make OpenCV single threaded, create OCR engine and run it on a blank image
+    and create text detector, so model files are loaded before the first frame
+
+    Keyword Arguments:
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors for Tesseract (default: {1})
+        debug {bool} -- enable debug output (default: {False})
+        options {dict} -- other keyword arguments of recognizer.process_one_image (default: {None})
+        profile {dict} -- keyword arguments of profile_helpers.enable, profiling is disabled if None (default: {None})
+        detect_batch {int} -- number of frames of which text blocks are detected at once, 
+            see recognise_frames (default: {1})
+        frame_cache {str} -- path to frame_helpers.FrameCache, names given to recognise_job
+            are read from it (default: {None})
+        started_q {mp.SimpleQueue} -- queue of TaskTracker, tracked_job reports started tasks to it (default: {None})
+        store {tuple} -- (path, recognition parameters) of store_helpers.ResultStore, see use_store (default: {None})
+    """
+    _worker["padding"] = padding
+    _worker["scaling_factor"] = scaling_factor
+    _worker["debug"] = debug
+    _worker["options"] = {} if options is None else options
+    _worker["detect_batch"] = detect_batch
+    _worker["frames"] = None if frame_cache is None else frame_helpers.FrameCache(frame_cache)
+    _worker["started_q"] = started_q
+    use_store(store)
+    # state shared by frames processed in this worker
+    _worker["cache"] = {}
+    # workers are already running in parallel
+    cv2.setNumThreads(1)
+    engine = _worker["options"].get("engine", consts.DEFAULT_OCR_ENGINE)
+    try:
+        cv_helpers.get_ocr_engine(engine).image_to_string(np.full((32, 32), 255, np.uint8))
+    except pytesseract.TesseractNotFoundError:
+        logger.critical("Tesseract not found")
+    except Exception:
+        logger.exception("Could not start OCR engine %s"%engine)
+    detector = _worker["options"].get("detector", consts.DEFAULT_TEXT_DETECTOR)
+    try:
+        cv_helpers.get_text_detector(detector)
+    except Exception:
+        logger.exception("Could not start text detector %s"%detector)
+    # counts inherited from the parent process are dropped, loading of the engine is not measured
+    recognizer.pop_attempts()
+    if profile is not None:
+        profile_helpers.enable(**profile)
+
+def use_store(store=None):
+    """Choose the result store recognise_job looks up frames in, stores stay open 
+    until the worker exits, they are only read by workers
+
+    Keyword Arguments:
+        store {tuple} -- (path, recognition parameters) of store_helpers.ResultStore, 
+            frames are not looked up if None (default: {None})
+    """
+    stores = _worker.setdefault("stores", {})
+    if store is not None and store[0] not in stores:
+        stores[store[0]] = store_helpers.ResultStore(*store)
+    _worker["store"] = None if store is None else stores[store[0]]
+
+def recognise_image(input_path, name=None, boxes=None):
+    """Recognize one frame with settings of the worker, errors are logged
+    and an empty result is returned, so every frame gives exactly one result
+
+    Arguments:
+        input_path {str or cv2.image} -- path to image file or decoded image
+
+    Keyword Arguments:
+        name {str} -- value of the "file" field, input_path if None (default: {None})
+        boxes {list} -- text blocks detected beforehand, detected by recognizer if None (default: {None})
+
+    Returns:
+        (bool, dict) -- (False if recognition failed with an error, result)
+    """
+    name = input_path if name is None else name
+    try:
+        with profile_helpers.span("frame", {"file": name}):
+            _, _, result = recognizer.process_one_image(input_path, None, _worker["padding"],
+                _worker["scaling_factor"], _worker["debug"], name=name, cache=_worker["cache"],
+                layout_boxes=boxes, **_worker["options"])
+    except Exception:
+        logger.exception("Failed processing %s"%name)
+        return False, recognizer.new_result(name)
+    return True, result
+
+def layout_cached():
+    """Check if the next frame of the worker is recognized with text blocks or keys from its cache first,
+    then text blocks are detected only if that fails
+
+    Returns:
+        bool -- True if the cache of an enabled reuse option is filled
+    """
+    options = _worker["options"]
+    cache = _worker["cache"]
+    return (options.get("reuse_layout", False) and "layout" in cache) or \
+        (options.get("reuse_keys", False) and "table" in cache) or \
+        (options.get("crop_table", False) and "band" in cache)
+
+def recognise_frames(frames):
+    """Recognize frames with settings of the worker, if detect_batch of the worker is above 1
+    text blocks of every detect_batch frames are detected at once, which runs the network 
+    of a DNN text detector once for all of them. Frames recognized while layout_cached
+    are not detected beforehand, as detection is needed only for frames where the cache fails
+
+    Arguments:
+        frames {list} -- list of (path to image file or decoded image, name) tuples, 
+            name is the path if None
+
+    Returns:
+        list -- (bool, dict) tuples from recognise_image
+    """
+    batch_size = _worker.get("detect_batch", 1)
+    if batch_size <= 1:
+        return [recognise_image(image, name) for image, name in frames]
+    options = _worker["options"]
+    caching = any(options.get(o, False) for o in ("reuse_layout", "reuse_keys", "crop_table"))
+    detector = cv_helpers.get_text_detector(options.get("detector", consts.DEFAULT_TEXT_DETECTOR))
+    results = []
+    i = 0
+    while i < len(frames):
+        # the first frame may fill the cache, so it is not detected together with others
+        if caching and (i == 0 or layout_cached()):
+            results.append(recognise_image(*frames[i]))
+            i += 1
+            continue
+        batch = []
+        for image, name in frames[i:i+batch_size]:
+            name = image if name is None else name
+            if isinstance(image, str):
+                image = cv2.imread(image)
+            batch.append((image, name))
+        i += len(batch)
+        # frames which can not be read or detected are left to recognise_image, which reports them
+        readable = [image for image, _ in batch if image is not None]
+        try:
+            detected = iter(detector.detect_batch(readable))
+        except Exception:
+            logger.exception("Text detection failed for %d frames, detecting one by one"%len(readable))
+            detected = iter([None]*len(readable))
+        for image, name in batch:
+            boxes = None if image is None else next(detected)
+            results.append(recognise_image(image, name, boxes))
+    return results
+
+def recognise_job(fnames):
+    """Recognize a chunk of frame files with settings of the worker, if the worker has a result store
+    frames are hashed and frames with stored results are not recognized again
+
+    Arguments:
+        fnames {list} -- paths to image files, names of frames if the worker has a frame cache
+
+    Returns:
+        (list, list, dict, dict) -- (stored results, (hash, result) tuples of recognized frames, 
+            hash is None if recognition failed or there is no store, profile_helpers.collect data,
+            recognizer.pop_attempts counts)
+    """
+    frame_cache = _worker.get("frames")
+    store = _worker.get("store")
+    stored = []
+    frames = []
+    hashes = []
+    for f in fnames:
+        image = f if frame_cache is None else frame_cache.image(f)
+        content_hash = None
+        if store is not None:
+            # hash of the decoded image for frames of the cache, which have no file
+            content_hash = store_helpers.file_hash(f) if frame_cache is None else store_helpers.image_hash(image)
+            result = store.get(f, content_hash)
+            if result is not None:
+                stored.append(result)
+                continue
+        frames.append((image, None if frame_cache is None else f))
+        hashes.append(content_hash)
+    results = [(content_hash if ok else None, result) for content_hash, (ok, result) in zip(hashes, recognise_frames(frames))]
+    return stored, results, profile_helpers.collect(), recognizer.pop_attempts()
+
+def new_progress(n_total=None):
+    """Create progress state of a run for update_progress and log_progress
+
+    Keyword Arguments:
+        n_total {int} -- total number of frames, None if unknown (default: {None})
+
+    Returns:
+        dict -- progress state
+    """
+    now = time.time()
+    return {
+        "start": now,
+        "last_log": now,
+        "last_done": now,
+        "done": 0,
+        "total": n_total,
+        # (frame number, number of frames) of the decoder if total is not known
+        "position": None,
+        "attempts": {}
+    }
+
+def update_progress(progress, n_done=0, attempts=None, position=None):
+    """Add processed frames and recognition counts sent by a worker
+
+    Arguments:
+        progress {dict} -- progress state from new_progress
+
+    Keyword Arguments:
+        n_done {int} -- number of new processed frames (default: {0})
+        attempts {dict} -- recognizer.pop_attempts counts of a worker (default: {None})
+        position {tuple} -- (frame number, number of frames) of the decoder (default: {None})
+    """
+    if n_done > 0:
+        progress["done"] += n_done
+        progress["last_done"] = time.time()
+    if position is not None:
+        progress["position"] = position
+    if attempts:
+        for s, counts in attempts.items():
+            total = progress["attempts"].setdefault(s, {"tried": 0, "keys": 0, "values": 0})
+            for k in counts:
+                total[k] += counts[k]
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d"%(seconds//3600, seconds//60%60, seconds%60)
+
+def log_progress(progress, force=False):
+    """Log processed frames, throughput, ETA and share of frames where keys or values were not recognized 
+    with every scaling factor, at most once per PROGRESS_INTERVAL seconds
+
+    Arguments:
+        progress {dict} -- progress state from new_progress
+
+    Keyword Arguments:
+        force {bool} -- log now, e.g. the summary at the end (default: {False})
+    """
+    now = time.time()
+    if not force and now - progress["last_log"] < PROGRESS_INTERVAL:
+        return
+    progress["last_log"] = now
+    elapsed = max(now - progress["start"], 1e-3)
+    n_done = progress["done"]
+    msg = "Processed %d"%n_done
+    if progress["total"] is not None:
+        msg += "/%d"%progress["total"]
+    msg += " frames in %s, %.2f frames/s"%(format_duration(elapsed), n_done/elapsed)
+    fraction = None
+    if progress["total"]:
+        fraction = n_done/progress["total"]
+    elif progress["position"] is not None and progress["position"][1] > 0:
+        fraction = progress["position"][0]/progress["position"][1]
+    if not force and fraction:
+        msg += ", ETA %s"%format_duration(elapsed*(1 - fraction)/fraction)
+    if not force and now - progress["last_done"] >= PROGRESS_INTERVAL:
+        msg += ", no frame done for %s"%format_duration(now - progress["last_done"])
+    failures = ["%s: %.0f%% keys, %.0f%% values"%(s, 100*c["keys"]/c["tried"], 100*c["values"]/c["tried"])
+        for s, c in sorted(progress["attempts"].items()) if c["tried"] > 0]
+    if len(failures) > 0:
+        msg += ", failed with scaling factor " + "; ".join(failures)
+    logger.info(msg)
+
+def tracked_job(task):
+    """Run a task submitted by TaskTracker, the worker reports which task it starts
+
+    Arguments:
+        task {tuple} -- (function, task key, argument)
+
+    Returns:
+        (int, object) -- (task key, result of the function)
+    """
+    func, key, arg = task
+    if _worker.get("started_q") is not None:
+        _worker["started_q"].put((key, os.getpid()))
+    return key, func(arg)
+
+class TaskTracker:
+    """Finds tasks lost with a pool worker which died, e.g. killed for lack of memory, 
+    Pool replaces the worker but never returns a result for its task.
+    Workers report every started task through started_q, which is passed to init_worker. 
+    A task of a dead worker is submitted again up to MAX_TASK_RETRIES times, then the run fails.
+    A worker may die after taking a task and before reporting it, so when a worker dies tasks 
+    which no worker reported are submitted again as well, without counting a retry.
+    A result which arrives after its task was submitted again is dropped by finish.
+    Used only from the thread which consumes results
+    """
+
+    def __init__(self):
+        self.started_q = mp.SimpleQueue()
+        # key to (function, argument, callback, error callback, retries)
+        self.pending = {}
+        # key to process id of the worker which started the task
+        self.running = {}
+        # keys of tasks whose worker was found dead once, they are lost if it is found dead again
+        self.suspects = set()
+        # process ids of workers alive at the first submit or the last check, 
+        # Pool starts a new worker only in place of one which died
+        self.workers = None
+        self.next_key = 0
+        self.last_check = time.time()
+
+    def submit(self, pool, func, arg, callback, error_callback):
+        """Submit task to the pool
+
+        Arguments:
+            pool {mp.Pool} -- pool with init_worker getting started_q
+            func {function} -- function to apply
+            arg {object} -- argument
+            callback {function} -- called with (task key, result), see finish
+            error_callback {function} -- called with (task key, exception), see finish
+        """
+        if self.workers is None:
+            self.workers = set(p.pid for p in list(pool._pool))
+        key = self.next_key
+        self.next_key += 1
+        self.pending[key] = (func, arg, callback, error_callback, 0)
+        self.apply(pool, key)
+
+    def apply(self, pool, key):
+        func, arg, callback, error_callback, _ = self.pending[key]
+        pool.apply_async(tracked_job, ((func, key, arg),), callback=callback, 
+            error_callback=lambda e: error_callback(key, e))
+
+    def finish(self, key):
+        """Mark task done
+
+        Arguments:
+            key {int} -- task key from the callback
+
+        Returns:
+            bool -- False if the result is a duplicate of a task submitted again and must be dropped
+        """
+        self.running.pop(key, None)
+        self.suspects.discard(key)
+        return self.pending.pop(key, None) is not None
+
+    def check(self, pool, force=False):
+        """Submit again tasks of workers which died, at most once per WORKER_CHECK_INTERVAL seconds
+
+        Arguments:
+            pool {mp.Pool} -- pool the tasks were submitted to
+
+        Keyword Arguments:
+            force {bool} -- check now (default: {False})
+
+        Raises:
+            RuntimeError -- if a task was lost more than MAX_TASK_RETRIES times
+        """
+        if not force and time.time() - self.last_check < WORKER_CHECK_INTERVAL:
+            return
+        self.last_check = time.time()
+        while not self.started_q.empty():
+            key, pid = self.started_q.get()
+            if key in self.pending:
+                self.running[key] = pid
+        alive = set(p.pid for p in list(pool._pool) if p.is_alive())
+        replaced = self.workers is not None and alive != self.workers
+        self.workers = alive
+        if replaced:
+            unreported = sorted(key for key in self.pending if key not in self.running)
+            if len(unreported) > 0:
+                logger.error("Worker died, submitting %d tasks not reported as started again"%len(unreported))
+            for key in unreported:
+                self.apply(pool, key)
+        dead = set(key for key, pid in self.running.items() if pid not in alive)
+        # a result may be on its way from a worker which has just exited, it is waited for once
+        lost = dead & self.suspects
+        self.suspects = dead - lost
+        for key in sorted(lost):
+            func, arg, callback, error_callback, retries = self.pending[key]
+            del self.running[key]
+            if retries >= MAX_TASK_RETRIES:
+                raise RuntimeError("Task %s of %s was lost %d times with a dead worker, e.g. killed for lack of memory"%(
+                    key, func.__name__, retries + 1))
+            logger.error("Worker died running %s, submitting the task again"%func.__name__)
+            self.pending[key] = (func, arg, callback, error_callback, retries + 1)
+            self.apply(pool, key)
+
+def imap_bounded(pool, func, tasks, max_pending, on_idle=None, tracker=None):
+    """Like Pool.imap_unordered, but at most max_pending tasks are submitted
+    and not yet consumed at any time, so neither tasks nor results pile up in memory
+
+    Arguments:
+        pool {mp.Pool} -- worker pool
+        func {function} -- function to apply to every task
+        tasks {iterable} -- tasks, consumed lazily
+        max_pending {int} -- maximum number of submitted but not consumed tasks
+
+    Keyword Arguments:
+        on_idle {function} -- called without arguments every PROGRESS_INTERVAL seconds 
+            without a result (default: {None})
+        tracker {TaskTracker} -- tracker of the pool, tasks lost with a dead worker are submitted again,
+            a pool without tracker waits forever for them (default: {None})
+
+    Yields:
+        object -- func results in order of completion
+    """
+    done = queue.Queue()
+    tasks = iter(tasks)
+    pending = 0
+    exhausted = False
+    timeout = None if on_idle is None else PROGRESS_INTERVAL
+    if tracker is not None:
+        timeout = WORKER_CHECK_INTERVAL
+    last_result = time.time()
+    while True:
+        while not exhausted and pending < max_pending:
+            try:
+                task = next(tasks)
+            except StopIteration:
+                exhausted = True
+                break
+            if tracker is not None:
+                tracker.submit(pool, func, task, done.put, lambda key, e: done.put(e))
+            else:
+                pool.apply_async(func, (task,), callback=done.put, error_callback=done.put)
+            pending += 1
+        if pending == 0:
+            break
+        if tracker is not None:
+            tracker.check(pool)
+        try:
+            res = done.get(timeout=timeout)
+        except queue.Empty:
+            if on_idle is not None and time.time() - last_result >= PROGRESS_INTERVAL:
+                on_idle()
+            continue
+        if isinstance(res, Exception):
+            raise res
+        if tracker is not None:
+            key, res = res
+            if not tracker.finish(key):
+                continue
+        pending -= 1
+        last_result = time.time()
+        yield res
+
+def recognise_files(fnames, n_proc, padding=0, scaling_factor=1, debug=False, chunk_size=1, max_pending=None,
+        options=None, store=None, profile=None, detect_batch=1, frame_cache=None):
+    """Recognize frame files in a pool of worker processes,
+    every free worker takes next chunk_size files, so one slow part of the list
+    does not leave other workers idle
+
+    Arguments:
+        fnames {list} -- paths to image files
+        n_proc {int} -- number of worker processes
+
+    Keyword Arguments:
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors for Tesseract (default: {1})
+        debug {bool} -- enable debug output (default: {False})
+        chunk_size {int} -- number of files given to a worker at once (default: {1})
+        max_pending {int} -- maximum number of chunks in flight, 2*n_proc if None (default: {None})
+        options {dict} -- other keyword arguments of recognizer.process_one_image (default: {None})
+        store {store_helpers.ResultStore} -- stored results are used instead of recognizing files again,
+            workers hash and look up the files of their chunks, new results are stored (default: {None})
+        profile {dict} -- keyword arguments of profile_helpers.enable for workers, their data
+            is merged into this process (default: {None})
+        detect_batch {int} -- number of frames of which text blocks are detected at once,
+            chunk_size is raised to it (default: {1})
+        frame_cache {str} -- path to frame_helpers.FrameCache, fnames are names of its frames
+            and workers read them from the cache (default: {None})
+
+    Yields:
+        dict -- result for every file, as soon as it is ready
+    """
+    chunk_size = max(chunk_size, detect_batch)
+    if max_pending is None:
+        max_pending = 2*n_proc
+    n_total = len(fnames)
+    n_done = 0
+    n_stored = 0
+    if n_total == 0:
+        return
+    chunks = (fnames[i:i+chunk_size] for i in range(0, len(fnames), chunk_size))
+    store_args = None
+    if store is not None:
+        # workers read the store, results kept by this process so far are written for them
+        store.commit()
+        store_args = (store.path, store.params)
+    # stored results are counted as well, workers hash frames to find them
+    progress = new_progress(n_total)
+    tracker = TaskTracker()
+    with mp.Pool(n_proc, initializer=init_worker, 
+            initargs=(padding, scaling_factor, debug, options, profile, detect_batch, frame_cache, tracker.started_q, 
+                store_args)) as pool:
+        for stored, results, profile_data, attempts in imap_bounded(pool, recognise_job, chunks, max_pending, 
+                on_idle=lambda: log_progress(progress), tracker=tracker):
+            profile_helpers.merge(profile_data)
+            for result in stored:
+                n_stored += 1
+                n_done += 1
+                yield result
+            for content_hash, result in results:
+                if content_hash is not None:
+                    store.put(result["file"], content_hash, result)
+                n_done += 1
+                yield result
+            update_progress(progress, len(stored) + len(results), attempts)
+            log_progress(progress)
+    log_progress(progress, force=True)
+    if store is not None:
+        logger.info("Found %d stored results, recognized %d files"%(n_stored, n_done - n_stored))
+    if n_done != n_total:
+        logger.error("Got %d results for %d files"%(n_done, n_total))
+
+def init_extract_worker(input_path, output_folder, frames, middle_frame=None, tolerance=None, seek=False,
+        similarity=consts.DEFAULT_FRAME_SIMILARITY, frame_cache=None, index=None):
+    """Prepare worker process for extract_segment_job
+
+    Arguments:
+        input_path {str} -- path to video file
+        output_folder {str} -- folder for frame files
+        frames {list} -- sorted frame numbers to read
+
+    Keyword Arguments:
+        middle_frame {cv2.image} -- reference frame, frames not similar to it are skipped (default: {None})
+        tolerance {float} -- tolerance to skip similar frames, default of similarity if None (default: {None})
+        seek {bool} -- seek to the first frame of a segment by its number without checking the position (default: {False})
+        similarity {str} -- way to compare frames, key of cv_helpers.FRAME_SIMILARITY (default: {consts.DEFAULT_FRAME_SIMILARITY})
+        frame_cache {str} -- path to frame_helpers.FrameCache to write frames to instead of PNG files (default: {None})
+        index {dict} -- packet index from cv_helpers.get_video_keyframes, workers start decoding at the keyframe 
+            before their segment, from the beginning if None (default: {None})
+    """
+    method = cv_helpers.FRAME_SIMILARITY[similarity]
+    _worker["extract"] = {
+        "input_path": input_path,
+        "output_folder": output_folder,
+        "frames": frames,
+        "middle_frame": None if middle_frame is None else method["prepare"](middle_frame),
+        "tolerance": method["tolerance"] if tolerance is None else tolerance,
+        "seek": seek,
+        "index": index,
+        "method": method,
+        "frame_cache": None if frame_cache is None else frame_helpers.FrameCache(frame_cache, "r+")
+    }
+    cv2.setNumThreads(1)
+
+def extract_segment_job(segment):
+    """Decode one segment sequentially and write frames which are not similar to the previous kept frame,
+    the first frame of the segment is always kept. Decoding goes on into the next segment 
+    until the chain of kept frames of this segment and the chain of the next segment keep the same frame,
+    from that frame both chains are the same
+
+    Arguments:
+        segment {tuple} -- (first, last) index of frames, last is not included
+
+    Returns:
+        (int, list, int, dict) -- (first frame of the segment, kept frames of the segment, 
+            frame where chains meet or None, {frame: image} kept after the segment by this chain only)
+    """
+    s = _worker["extract"]
+    method = s["method"]
+    frames = s["frames"]
+    first, last = segment
+    end = frames[last] if last < len(frames) else None
+    kept = []
+    after = {}
+    meet = None
+    own = None
+    # chain of the next segment, same as the one started by its worker
+    other = None
+    vidcap = cv2.VideoCapture(s["input_path"])
+    try:
+        for f, image in cv_helpers.read_frames_sequential(vidcap, frames[first:], s["seek"], s["index"]):
+            if image is None:
+                logger.warning("Failed reading frame %d"%f)
+                continue
+            prepared = method["prepare"](image)
+            if s["middle_frame"] is not None and method["compare"](s["middle_frame"], prepared) < method["middle_tolerance"]:
+                continue
+            keep = own is None or method["compare"](own, prepared) < s["tolerance"]
+            if end is None or f < end:
+                if keep:
+                    own = prepared.copy()
+                    kept.append(f)
+                    if s["frame_cache"] is not None:
+                        s["frame_cache"].write(f, image)
+                    else:
+                        cv2.imwrite("%s/frame%d.png"%(s["output_folder"], f), image)
+                continue
+            keep_other = other is None or method["compare"](other, prepared) < s["tolerance"]
+            if keep and keep_other:
+                meet = f
+                break
+            if keep:
+                own = prepared.copy()
+                after[f] = image
+            if keep_other:
+                other = prepared.copy()
+    finally:
+        vidcap.release()
+    if s["frame_cache"] is not None:
+        s["frame_cache"].flush()
+    return frames[first], kept, meet, after
+
+def sample_frame_numbers(input_path):
+    """Choose one frame per second and the middle one of them as reference frame,
+    all frames and no reference frame if FPS is not known
+
+    Arguments:
+        input_path {str} -- path to video file
+
+    Returns:
+        (int, list, int) -- (number of frames, frame numbers, reference frame number or None)
+    """
+    n_frames, fps = cv_helpers.get_video_n_frames(input_path)
+    if fps == 0:
+        logger.warning("Could not detect video FPS, reading all frames")
+        return n_frames, list(range(n_frames)), None
+    frames = list(range(0, n_frames, fps))
+    return n_frames, frames, frames[math.floor(len(frames)/2)]
+
+def sample_video_frames(input_path):
+    """Like sample_frame_numbers, but the reference frame is read
+
+    Arguments:
+        input_path {str} -- path to video file
+
+    Returns:
+        (int, list, cv2.image) -- (number of frames, frame numbers, reference frame or None)
+    """
+    n_frames, frames, middle = sample_frame_numbers(input_path)
+    if middle is None:
+        return n_frames, frames, None
+    _, middle_frame = cv_helpers.get_video_frame(input_path, middle)
+    return n_frames, frames, middle_frame
+
+def plan_video(input_path, n_segments):
+    """Choose frames to read and split them into segments starting at keyframes
+
+    Arguments:
+        input_path {str} -- path to video file
+        n_segments {int} -- maximum number of segments
+
+    Returns:
+        (int, list, int, list, dict) -- (number of frames, frame numbers, reference frame number or None,
+            list of (first, last) segments, packet index from cv_helpers.get_video_keyframes or None)
+    """
+    n_frames, frames, middle = sample_frame_numbers(input_path)
+    index = cv_helpers.get_video_keyframes(input_path)
+    if index is None:
+        logger.warning("Could not find keyframes, splitting video evenly")
+        return n_frames, frames, middle, cv_helpers.split_video_segments(frames, n_segments), None
+    return n_frames, frames, middle, cv_helpers.split_video_segments(frames, n_segments, index["keyframes"]), index
+
+def join_segments(results, n_frames, output_folder, frame_cache=None):
+    """Join frames kept by extract_segment_job of all segments, every chain is followed 
+    until it meets the chain of a later segment, files of frames which are not on the 
+    joined chain are removed and frames kept only after the segment are written
+
+    Arguments:
+        results {list} -- extract_segment_job results of all segments
+        n_frames {int} -- number of frames in the video
+        output_folder {str} -- folder for frame files
+
+    Keyword Arguments:
+        frame_cache {frame_helpers.FrameCache} -- cache the frames are written to instead of files,
+            frames which are not on the joined chain are left out of its index (default: {None})
+
+    Returns:
+        list -- file names of kept frames in order
+    """
+    frame_list = []
+    removed = []
+    written = {}
+    pos = 0
+    for first, kept, meet, after in sorted(results, key=lambda r: r[0]):
+        frame_list += [f for f in kept if f >= pos]
+        removed += [f for f in kept if f < pos]
+        for f in sorted(after):
+            if f >= pos:
+                written[f] = after[f]
+                frame_list.append(f)
+        pos = max(pos, n_frames if meet is None else meet)
+    if frame_cache is not None:
+        for f in written:
+            frame_cache.write(f, written[f])
+        frame_cache.set_kept(frame_list)
+        return frame_cache.names()
+    for f in removed:
+        os.remove("%s/frame%d.png"%(output_folder, f))
+    for f in written:
+        cv2.imwrite("%s/frame%d.png"%(output_folder, f), written[f])
+    return ["%s/frame%d.png"%(output_folder, f) for f in frame_list]
+
+def extract_video(input_path, output_folder, n_proc, sequential=True, tolerance=None, 
+        similarity=consts.DEFAULT_FRAME_SIMILARITY, frame_cache=None):
+    """Write frames of the video which are not similar to the previous written frame,
+    segments starting at keyframes are decoded in parallel and joined, 
+    so the same frames are written as by one process
+
+    Arguments:
+        input_path {str} -- path to video file
+        output_folder {str} -- folder for frame files
+        n_proc {int} -- number of worker processes
+
+    Keyword Arguments:
+        sequential {bool} -- start segments at the keyframe before them, checked against the packet index, 
+            instead of seeking to them by frame number, which is exact only for constant frame rate videos (default: {True})
+        tolerance {float} -- tolerance to skip similar frames, default of similarity if None (default: {None})
+        similarity {str} -- way to compare frames, key of cv_helpers.FRAME_SIMILARITY (default: {consts.DEFAULT_FRAME_SIMILARITY})
+        frame_cache {str} -- path to frame_helpers.FrameCache file, frames are written to it 
+            instead of PNG files in output_folder (default: {None})
+
+    Returns:
+        (int, list) -- (number frames, file names or frame names in the cache)
+    """
+    n_frames, frames, middle, segments, index = plan_video(input_path, n_proc)
+    middle_frame = None
+    if middle is not None:
+        _, middle_frame = cv_helpers.get_video_frame(input_path, middle)
+    logger.info("Extracting %d frames in %d segment(s)"%(len(frames), len(segments)))
+    cache = None
+    if frame_cache is not None:
+        _, first_frame = cv_helpers.get_video_frame(input_path, frames[0])
+        cache = frame_helpers.create_frame_cache(frame_cache, output_folder, frames, first_frame.shape)
+
+    results = []
+    start = time.time()
+    with mp.Pool(min(n_proc, len(segments)), initializer=init_extract_worker, 
+            initargs=(input_path, output_folder, frames, middle_frame, tolerance, not sequential, similarity, 
+                frame_cache, index)) as pool:
+        for res in pool.imap_unordered(extract_segment_job, segments):
+            results.append(res)
+            elapsed = time.time() - start
+            logger.info("Extracted %d/%d segments in %s, ETA %s"%(len(results), len(segments), format_duration(elapsed),
+                format_duration(elapsed*(len(segments) - len(results))/len(results))))
+    frame_list = join_segments(results, n_frames, output_folder, cache)
+    return len(frame_list), frame_list
+
+def batch_plan_job(task):
+    """Run plan_video for one of many recordings
+
+    Arguments:
+        task {tuple} -- (recording index, path to video file, maximum number of segments)
+
+    Returns:
+        (int, tuple) -- (recording index, plan_video result)
+    """
+    i, input_path, n_segments = task
+    return i, plan_video(input_path, n_segments)
+
+def batch_extract_job(task):
+    """Run extract_segment_job for a segment of one of many recordings,
+    extraction settings of the recording are prepared once per worker
+
+    Arguments:
+        task {tuple} -- (recording index, keyword arguments of init_extract_worker 
+            with reference frame number "middle" instead of the image, segment)
+
+    Returns:
+        (int, tuple) -- (recording index, extract_segment_job result)
+    """
+    i, params, segment = task
+    if _worker.get("extract_recording") != i:
+        params = dict(params)
+        middle = params.pop("middle")
+        if middle is not None:
+            _, params["middle_frame"] = cv_helpers.get_video_frame(params["input_path"], middle)
+        init_extract_worker(**params)
+        _worker["extract_recording"] = i
+    return i, extract_segment_job(segment)
+
+def batch_recognise_job(task):
+    """Run recognise_job for frames of one of many recordings, frames of a recording share a cache 
+    and are looked up in its result store. Chunks of a recording are submitted together, so 
+    a worker gets them one after another and keeps only the cache of the last recording
+
+    Arguments:
+        task {tuple} -- (recording index, paths to image files, (path, recognition parameters) 
+            of the result store of the recording or None)
+
+    Returns:
+        (int, tuple) -- (recording index, recognise_job result)
+    """
+    i, fnames, store = task
+    use_store(store)
+    if _worker.get("cache_recording") != i:
+        _worker["cache"] = {}
+        _worker["cache_recording"] = i
+    return i, recognise_job(fnames)
+
+def process_recordings(recordings, n_proc, padding=0, scaling_factor=1, chunk_size=1, options=None, profile=None,
+        extract=True, recognise=True, sequential=True, tolerance=None, similarity=consts.DEFAULT_FRAME_SIMILARITY, 
+        stores=None, detect_batch=1):
+    """Extract and recognize frames of many recordings in one pool of worker processes,
+    frames of a recording are recognized as soon as its extraction is done, 
+    while other recordings are still extracted
+
+    Arguments:
+        recordings {list} -- list of (path to video file, folder for frame files) tuples
+        n_proc {int} -- number of worker processes
+
+    Keyword Arguments:
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors for Tesseract (default: {1})
+        chunk_size {int} -- number of files given to a worker at once (default: {1})
+        options {dict} -- other keyword arguments of recognizer.process_one_image (default: {None})
+        profile {dict} -- keyword arguments of profile_helpers.enable for workers, their data
+            is merged into this process (default: {None})
+        extract {bool} -- extract frames, PNG files in the folders are recognized otherwise (default: {True})
+        recognise {bool} -- recognize extracted frames (default: {True})
+        sequential {bool} -- start segments at the keyframe before them instead of seeking to them by frame number (default: {True})
+        tolerance {float} -- tolerance to skip similar frames, default of similarity if None (default: {None})
+        similarity {str} -- way to compare frames, key of cv_helpers.FRAME_SIMILARITY (default: {consts.DEFAULT_FRAME_SIMILARITY})
+        stores {list} -- store_helpers.ResultStore of every recording or None, workers hash and look up
+            the frames of their chunks (default: {None})
+        detect_batch {int} -- number of frames of which text blocks are detected at once,
+            chunk_size is raised to it (default: {1})
+
+    Yields:
+        (int, dict) -- (recording index, result) for every frame, 
+            (recording index, None) once all frames of the recording are done, or once it failed,
+            then the error is logged and no more results of the recording are given
+    """
+    chunk_size = max(chunk_size, detect_batch)
+    events = queue.Queue()
+    # a long recording is split into segments only if there are fewer recordings than workers
+    n_segments = max(1, math.ceil(n_proc/len(recordings)))
+    state = [{"n_frames": 0, "segments": 0, "results": [], "chunks": 0, "failed": False} for r in recordings]
+    n_active = len(recordings)
+    progress = new_progress()
+    n_total = 0
+    n_listed = 0
+    tracker = TaskTracker()
+    with mp.Pool(n_proc, initializer=init_worker, 
+            initargs=(padding, scaling_factor, False, options, profile, detect_batch, None, tracker.started_q)) as pool:
+        def submit(func, task, kind):
+            tracker.submit(pool, func, task, lambda res: events.put((kind, res[1], res[0])), 
+                lambda key, e: events.put(("error", (task[0], e), key)))
+
+        for i, (input_path, output_folder) in enumerate(recordings):
+            if extract:
+                submit(batch_plan_job, (i, input_path, n_segments), "plan")
+                continue
+            try:
+                fnames = [os.path.join(output_folder, f) for f in sorted(os.listdir(output_folder)) if f.endswith(".png")]
+            except OSError as e:
+                events.put(("error", (i, e), None))
+                continue
+            events.put(("frames", (i, fnames), None))
+
+        while n_active > 0:
+            tracker.check(pool)
+            try:
+                event = events.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                log_progress(progress)
+                continue
+            kind, (i, res), key = event
+            if key is not None and not tracker.finish(key):
+                continue
+            input_path, output_folder = recordings[i]
+            s = state[i]
+            # other tasks of a failed recording may still finish, it is already done
+            if s["failed"]:
+                continue
+            if kind == "error":
+                # a broken recording does not stop the others
+                logger.error("Failed processing %s, skipping it"%input_path, exc_info=res)
+                s["failed"] = True
+                n_active -= 1
+                yield i, None
+            elif kind == "plan":
+                n_frames, frames, middle, segments, index = res
+                logger.info("Extracting %d frames of %s in %d segment(s)"%(len(frames), input_path, len(segments)))
+                if not os.path.exists(output_folder):
+                    os.makedirs(output_folder)
+                s["n_frames"] = n_frames
+                s["segments"] = len(segments)
+                params = {"input_path": input_path, "output_folder": output_folder, "frames": frames, "middle": middle,
+                    "tolerance": tolerance, "seek": not sequential, "similarity": similarity, "index": index}
+                for segment in segments:
+                    submit(batch_extract_job, (i, params, segment), "segment")
+            elif kind == "segment":
+                s["results"].append(res)
+                if len(s["results"]) == s["segments"]:
+                    try:
+                        fnames = join_segments(s["results"], s["n_frames"], output_folder)
+                    except OSError as e:
+                        events.put(("error", (i, e), None))
+                        continue
+                    s["results"] = []
+                    logger.info("Extracted %d frames of %s"%(len(fnames), input_path))
+                    events.put(("frames", (i, fnames), None))
+            elif kind == "frames":
+                store = None
+                if stores is not None and stores[i] is not None:
+                    stores[i].commit()
+                    store = (stores[i].path, stores[i].params)
+                chunks = [res[j:j+chunk_size] for j in range(0, len(res), chunk_size)] if recognise else []
+                s["chunks"] = len(chunks)
+                for chunk in chunks:
+                    submit(batch_recognise_job, (i, chunk, store), "chunk")
+                n_total += len(res) if recognise else 0
+                n_listed += 1
+                if n_listed == len(recordings):
+                    progress["total"] = n_total
+                if len(chunks) == 0:
+                    n_active -= 1
+                    yield i, None
+            elif kind == "chunk":
+                stored, results, profile_data, attempts = res
+                profile_helpers.merge(profile_data)
+                for result in stored:
+                    yield i, result
+                for content_hash, result in results:
+                    if content_hash is not None:
+                        stores[i].put(result["file"], content_hash, result)
+                    yield i, result
+                update_progress(progress, len(stored) + len(results), attempts)
+                log_progress(progress)
+                s["chunks"] -= 1
+                if s["chunks"] == 0:
+                    n_active -= 1
+                    yield i, None
+    log_progress(progress, force=True)
+
+def decode_job(input_path, frames_q, n_workers, output_folder, save_frames=False, sequential=True, tolerance=None,
+        similarity=consts.DEFAULT_FRAME_SIMILARITY, results_q=None, store_path=None, store_params=None, ring=None):
+    """Decode video frames and put unique frames to the queue
+
+    Arguments:
+        input_path {str} -- path to video file
+        frames_q {mp.Queue} -- bounded queue for (name, image or slot of ring, hash) tuples
+        n_workers {int} -- number of OCR workers to notify when decoding is done
+        output_folder {str} -- folder for frame files
+
+    Keyword Arguments:
+        save_frames {bool} -- write frames to PNG files as well (default: {False})
+        sequential {bool} -- decode the stream once instead of seeking to every frame (default: {True})
+        tolerance {float} -- tolerance to skip similar frames, default of similarity if None (default: {None})
+        similarity {str} -- way to compare frames, key of cv_helpers.FRAME_SIMILARITY (default: {consts.DEFAULT_FRAME_SIMILARITY})
+        results_q {mp.Queue} -- queue for ("position", (frame number, number of frames)) and
+            ("result", (None, result, None)) of frames with stored results, ("decoded", number of frames
+            queued or with stored result) and ("done", process id) are put at the end (default: {None})
+        store_path {str} -- path to store_helpers.ResultStore file, frames with stored results 
+            are not recognized again (default: {None})
+        store_params {dict} -- recognition parameters of the store (default: {None})
+        ring {frame_helpers.FrameRing} -- frames are copied to shared memory and only their slot 
+            is put to the queue (default: {None})
+    """
+    store = None
+    if store_path is not None:
+        store = store_helpers.ResultStore(store_path, store_params)
+    n_frames, fps = cv_helpers.get_video_n_frames(input_path)
+    frames = None
+    middle_frame = None
+    if fps == 0:
+        logger.warning("Could not detect video FPS, reading all frames")
+    else:
+        frames = list(range(0, n_frames, fps))
+        _, middle_frame = cv_helpers.get_video_frame(input_path, frames[math.floor(len(frames)/2)])
+    n_decoded = 0
+    for f, image in cv_helpers.iter_video_frames(input_path, frames, middle_frame, tolerance, 
+            sequential=sequential, similarity=similarity):
+        n_decoded += 1
+        name = "%s/frame%d.png"%(output_folder, f)
+        if results_q is not None:
+            results_q.put(("position", (f, n_frames)))
+        if save_frames:
+            cv2.imwrite(name, image)
+        content_hash = None
+        if store is not None:
+            content_hash = store_helpers.image_hash(image)
+            result = store.get(name, content_hash)
+            if result is not None:
+                results_q.put(("result", (None, result, None)))
+                continue
+        slot = None if ring is None else ring.put(image)
+        frames_q.put((name, image if slot is None else slot, content_hash))
+    for i in range(n_workers):
+        frames_q.put(None)
+    if store is not None:
+        store.close()
+    if results_q is not None:
+        results_q.put(("decoded", n_decoded))
+        results_q.put(("done", os.getpid()))
+
+def ocr_job(frames_q, results_q, padding=0, scaling_factor=1, debug=False, options=None, profile=None, 
+        detect_batch=1, ring=None):
+    """Recognize frames from the queue until None is received, frames already waiting
+    in the queue are taken together up to detect_batch
+
+    Arguments:
+        frames_q {mp.Queue} -- queue with (name, image or slot of ring, hash) tuples
+        results_q {mp.Queue} -- queue for ("result", (hash, result, recognizer.pop_attempts counts)),
+            hash is None if recognition failed, ("profile", profile_helpers.collect data) 
+            and ("done", process id) are put at the end
+
+    Keyword Arguments:
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors for Tesseract (default: {1})
+        debug {bool} -- enable debug output (default: {False})
+        options {dict} -- other keyword arguments of recognizer.process_one_image (default: {None})
+        profile {dict} -- keyword arguments of profile_helpers.enable (default: {None})
+        detect_batch {int} -- maximum number of frames of which text blocks are detected at once (default: {1})
+        ring {frame_helpers.FrameRing} -- shared memory with frames, a slot is released 
+            once its frame is recognized (default: {None})
+    """
+    init_worker(padding, scaling_factor, debug, options, profile, detect_batch)
+    running = True
+    while running:
+        tasks = [frames_q.get()]
+        # a batch is not waited for, frames are not held back while the decoder is slower than OCR
+        while tasks[-1] is not None and len(tasks) < detect_batch:
+            try:
+                tasks.append(frames_q.get_nowait())
+            except queue.Empty:
+                break
+        if tasks[-1] is None:
+            running = False
+            tasks.pop()
+        if len(tasks) == 0:
+            break
+        slots = [image for _, image, _ in tasks if isinstance(image, int)]
+        results = recognise_frames([(ring.view(image) if isinstance(image, int) else image, name) 
+            for name, image, _ in tasks])
+        for slot in slots:
+            ring.release(slot)
+        for (_, _, content_hash), (ok, result) in zip(tasks, results):
+            results_q.put(("result", (content_hash if ok else None, result, recognizer.pop_attempts())))
+    if profile is not None:
+        results_q.put(("profile", profile_helpers.collect()))
+    results_q.put(("done", os.getpid()))
+
+def create_frame_ring(input_path, n_slots):
+    """Create shared memory for frames of the video, the first frame gives the size of slots
+
+    Arguments:
+        input_path {str} -- path to video file
+        n_slots {int} -- number of frames in flight
+
+    Returns:
+        frame_helpers.FrameRing -- ring, None if shared memory is not supported, the first frame 
+            can not be read or there is not enough shared memory
+    """
+    if not frame_helpers.shared_memory_available(0):
+        logger.warning("Shared memory is not supported, it needs Python 3.8, passing frames through the queue")
+        return None
+    _, frame = cv_helpers.get_video_frame(input_path, 0)
+    if frame is None:
+        logger.warning("Could not read first frame, passing frames through the queue")
+        return None
+    if not frame_helpers.shared_memory_available(n_slots*frame.nbytes):
+        logger.warning("Not enough shared memory for %d frames (%d MB), passing frames through the queue"%(
+            n_slots, n_slots*frame.nbytes//2**20))
+        return None
+    logger.info("Passing frames through %d slots of shared memory (%d MB)"%(n_slots, n_slots*frame.nbytes//2**20))
+    return frame_helpers.FrameRing(n_slots, frame.shape)
+
+def stream_video(input_path, output_folder, n_proc, padding=0, scaling_factor=1, save_frames=False,
+        sequential=True, tolerance=None, similarity=consts.DEFAULT_FRAME_SIMILARITY, queue_size=None, options=None,
+        store=None, profile=None, detect_batch=1, shared_memory=False):
+    """Decode video and recognize frames concurrently without writing them to disk,
+    decoded frames are passed to OCR workers through a bounded queue
+
+    Arguments:
+        input_path {str} -- path to video file
+        output_folder {str} -- folder for frame files
+        n_proc {int} -- number of OCR workers
+
+    Keyword Arguments:
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors for Tesseract (default: {1})
+        save_frames {bool} -- write frames to PNG files as well (default: {False})
+        sequential {bool} -- decode the stream once instead of seeking to every frame (default: {True})
+        tolerance {float} -- tolerance to skip similar frames, default of similarity if None (default: {None})
+        similarity {str} -- way to compare frames, key of cv_helpers.FRAME_SIMILARITY (default: {consts.DEFAULT_FRAME_SIMILARITY})
+        queue_size {int} -- maximum number of decoded frames waiting for OCR, 2*n_proc*detect_batch if None (default: {None})
+        options {dict} -- other keyword arguments of recognizer.process_one_image (default: {None})
+        store {store_helpers.ResultStore} -- stored results are used instead of recognizing frames again,
+            new results are stored (default: {None})
+        profile {dict} -- keyword arguments of profile_helpers.enable for workers, their data
+            is merged into this process (default: {None})
+        detect_batch {int} -- maximum number of frames of which text blocks are detected at once (default: {1})
+        shared_memory {bool} -- copy frames to a frame_helpers.FrameRing and pass only slot numbers 
+            through the queue instead of pickled frames (default: {False})
+
+    Yields:
+        dict -- result for every frame
+
+    Raises:
+        RuntimeError -- if the decoder or an OCR worker crashed, frames taken by a crashed worker are lost
+    """
+    if queue_size is None:
+        queue_size = 2*n_proc*detect_batch
+    frames_q = mp.Queue(queue_size)
+    results_q = mp.Queue()
+    ring = None
+    if shared_memory:
+        ring = create_frame_ring(input_path, queue_size + n_proc*detect_batch)
+    decode_kwargs = {"save_frames": save_frames, "sequential": sequential, "tolerance": tolerance, 
+        "similarity": similarity, "results_q": results_q, "ring": ring}
+    if store is not None:
+        store.commit()
+        decode_kwargs.update({"store_path": store.path, "store_params": store.params})
+    decoder = mp.Process(target=decode_job, args=(input_path, frames_q, n_proc, output_folder), kwargs=decode_kwargs)
+    procs = [mp.Process(target=ocr_job, 
+        args=(frames_q, results_q, padding, scaling_factor, False, options, profile, detect_batch, ring))
+        for i in range(n_proc)]
+    decoder.start()
+    for p in procs:
+        p.start()
+    # results are drained while workers are running, so they never block on a full pipe
+    # decoder sends its position and stored results
+    alive = set(procs + [decoder])
+    decoding = True
+    n_crashed = 0
+    n_decoded = None
+    n_results = 0
+    completed = False
+    progress = new_progress()
+    try:
+        while len(alive) > 0:
+            try:
+                kind, payload = results_q.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                # a crashed process never sends its end marker
+                if decoding and not decoder.is_alive():
+                    decoding = False
+                    if decoder.exitcode != 0:
+                        logger.error("Decoder exited with code %d"%decoder.exitcode)
+                        n_crashed += 1
+                        alive.discard(decoder)
+                        for p in alive:
+                            frames_q.put(None)
+                for p in list(alive):
+                    if p is not decoder and not p.is_alive() and p.exitcode != 0:
+                        logger.error("Worker exited with code %d, frames in progress are lost"%p.exitcode)
+                        alive.discard(p)
+                        n_crashed += 1
+                # without workers the decoder waits forever for space in the queue or the ring
+                if n_crashed > 0 and decoder in alive and not any(p in alive for p in procs):
+                    decoder.join(WORKER_CHECK_INTERVAL)
+                    if decoder.is_alive():
+                        raise RuntimeError("All OCR workers died, %d frames done"%progress["done"])
+                log_progress(progress)
+                continue
+            if kind == "done":
+                alive = set(p for p in alive if p.pid != payload)
+            elif kind == "profile":
+                profile_helpers.merge(payload)
+            elif kind == "position":
+                update_progress(progress, position=payload)
+            elif kind == "decoded":
+                n_decoded = payload
+            else:
+                content_hash, result, attempts = payload
+                if content_hash is not None and store is not None:
+                    store.put(result["file"], content_hash, result)
+                update_progress(progress, 1, attempts)
+                n_results += 1
+                yield result
+            log_progress(progress)
+        completed = True
+        log_progress(progress, force=True)
+        # a partial output must not look like a complete one
+        if n_crashed > 0 or n_decoded != n_results:
+            raise RuntimeError("Got %d results for %s decoded frames, %d process(es) crashed"%(
+                n_results, "unknown number of" if n_decoded is None else n_decoded, n_crashed))
+    finally:
+        # processes are stopped if the run failed or results are not consumed any more
+        decoder.join(PROGRESS_INTERVAL if completed else 0)
+        if decoder.is_alive():
+            decoder.terminate()
+        for p in procs:
+            if not completed and p.is_alive():
+                p.terminate()
+            p.join()
+        if ring is not None:
+            ring.close(unlink=True)
@@ -0,0 +1,223 @@
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import os, datetime, logging
+import pandas as pd
+
+import consts
+
+logger = logging.getLogger('')
+
+# number of timestamps written as one record batch
+BATCH_SIZE = 1000
+
+# file extensions written with ArrowWriter
+ARROW_FORMATS = [".parquet", ".arrow", ".feather"]
+
+def open_writer(path):
+    """Create writer by file extension, Parquet and Arrow IPC are written while results arrive,
+    CSV is written at the end
+
+    Arguments:
+        path {str} -- path to output file
+
+    Returns:
+        CsvWriter or ArrowWriter -- writer
+    """
+    if os.path.splitext(path)[1].lower() in ARROW_FORMATS:
+        return ArrowWriter(path)
+    return CsvWriter(path)
+
+class CsvWriter:
+    """Collects results in memory and writes them to CSV file on close,
+    one row per timestamp with the first value of every column"""
+
+    def __init__(self, path):
+        self.path = path
+        self.n_results = 0
+        self.data = {}
+        for k in consts.EXPECTED_KEYS:
+            self.data[k] = []
+        self.data["file"] = []
+
+    def write(self, result):
+        for k in result:
+            self.data[k].append(result[k])
+        self.n_results += 1
+
+    def close(self):
+        df = pd.DataFrame(data=self.data)
+        df = df.groupby("timestamp").first().sort_values(by=["timestamp"]).reset_index()
+        df.to_csv(self.path)
+
+class ArrowWriter:
+    """Writes results to Parquet or Arrow IPC file in typed record batches while they arrive,
+    one row per timestamp with the first value of every column like CsvWriter.
+    Rows are merged in memory until 2*batch_size timestamps are pending, then the oldest
+    batch_size timestamps are written, a result for a timestamp which is already written is dropped.
+    A result older than written rows, e.g. of a slow worker, goes to a later batch, then the file 
+    is read and written again sorted on close.
+    pyarrow is not in requirements.txt and has to be installed separately.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        """Open the file
+
+        Arguments:
+            path {str} -- path to .parquet file, Arrow IPC file otherwise
+
+        Keyword Arguments:
+            batch_size {int} -- number of timestamps in one record batch (default: {BATCH_SIZE})
+        """
+        import pyarrow as pa
+        self.pa = pa
+        self.path = path
+        self.batch_size = batch_size
+        self.n_results = 0
+        self.n_dropped = 0
+        fields = [(k, arrow_type(pa, v["dtype"])) for k, v in consts.EXPECTED_KEYS.items()]
+        self.schema = pa.schema(fields + [("file", pa.string())])
+        if os.path.splitext(path)[1].lower() == ".parquet":
+            import pyarrow.parquet as pq
+            self._parquet = pq.ParquetWriter(path, self.schema)
+            self._ipc = None
+        else:
+            self._parquet = None
+            self._ipc = pa.ipc.new_file(path, self.schema)
+        # timestamp to merged row
+        self._pending = {}
+        self._written = set()
+        self._last = None
+        self._unsorted = False
+
+    def write(self, result):
+        """Merge result into the row of its timestamp, results without timestamp are skipped
+
+        Arguments:
+            result {dict} -- result of recognizer.process_one_image
+        """
+        self.n_results += 1
+        timestamp = result.get("timestamp")
+        if timestamp is None:
+            return
+        if timestamp.tzinfo is not None:
+            # timestamps with and without offset can not be sorted together
+            timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            result = dict(result, timestamp=timestamp)
+        if timestamp in self._written:
+            self.n_dropped += 1
+            return
+        row = self._pending.get(timestamp)
+        if row is None:
+            self._pending[timestamp] = dict(result)
+        else:
+            for k, v in result.items():
+                if row.get(k) is None:
+                    row[k] = v
+        if len(self._pending) >= 2*self.batch_size:
+            self.flush(self.batch_size)
+
+    def flush(self, n=None):
+        """Write pending rows of the oldest timestamps
+
+        Keyword Arguments:
+            n {int} -- number of timestamps to write, all if None (default: {None})
+        """
+        timestamps = sorted(self._pending)[:n]
+        if len(timestamps) == 0:
+            return
+        rows = [self._pending.pop(t) for t in timestamps]
+        self._written.update(timestamps)
+        if self._last is not None and timestamps[0] < self._last:
+            self._unsorted = True
+        if self._last is None or timestamps[-1] > self._last:
+            self._last = timestamps[-1]
+        batch = self.pa.RecordBatch.from_pydict(
+            dict((name, [r.get(name) for r in rows]) for name in self.schema.names), schema=self.schema)
+        if self._parquet is not None:
+            self._parquet.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self._ipc.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        if self._parquet is not None:
+            self._parquet.close()
+        else:
+            self._ipc.close()
+        if self.n_dropped > 0:
+            logger.info("Dropped %d results of already written timestamps"%self.n_dropped)
+        if self._unsorted:
+            logger.info("Rows were written out of order, sorting %s"%self.path)
+            self.sort_file()
+
+    def sort_file(self):
+        """Read the closed file and write it again sorted by timestamp, the whole table is held in memory"""
+        pa = self.pa
+        if self._parquet is not None:
+            import pyarrow.parquet as pq
+            table = pq.read_table(self.path)
+        else:
+            with pa.memory_map(self.path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        table = table.sort_by("timestamp")
+        tmp_path = self.path + ".tmp"
+        if self._parquet is not None:
+            pq.write_table(table, tmp_path, row_group_size=self.batch_size)
+        else:
+            with pa.ipc.new_file(tmp_path, table.schema) as writer:
+                writer.write_table(table, max_chunksize=self.batch_size)
+        os.replace(tmp_path, self.path)
+
+def arrow_type(pa, dtype):
+    """Arrow type of the "dtype" field of consts.EXPECTED_KEYS
+
+    Arguments:
+        pa {module} -- pyarrow
+        dtype {str} -- "timestamp" or Arrow type alias, e.g. "int16"
+
+    Returns:
+        pyarrow.DataType -- type, timestamps are in UTC: timestamps with offset are converted 
+            and timestamps without offset are written as they are
+    """
+    if dtype == "timestamp":
+        return pa.timestamp("us", tz="UTC")
+    return pa.type_for_alias(dtype)
+
+def combine_outputs(outputs, output_path):
+    """Join output files of several recordings into one file of the same format
+    with the name of the recording in the "recording" column
+
+    Arguments:
+        outputs {list} -- list of (recording name, path to output file) tuples
+        output_path {str} -- path to combined file
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in ARROW_FORMATS:
+        frames = []
+        for name, path in outputs:
+            df = pd.read_csv(path, index_col=0)
+            df["recording"] = name
+            frames.append(df)
+        pd.concat(frames, ignore_index=True).to_csv(output_path)
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tables = []
+    for name, path in outputs:
+        if os.path.splitext(path)[1].lower() == ".parquet":
+            table = pq.read_table(path)
+        else:
+            table = pa.ipc.open_file(path).read_all()
+        tables.append(table.append_column("recording", pa.array([name]*table.num_rows, pa.string())))
+    table = pa.concat_tables(tables)
+    if ext == ".parquet":
+        pq.write_table(table, output_path)
+    else:
+        with pa.ipc.new_file(output_path, table.schema) as writer:
+            writer.write_table(table)
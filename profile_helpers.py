@@ -0,0 +1,174 @@
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import os, json, math, time, logging, functools
+from contextlib import contextmanager
+
+logger = logging.getLogger('')
+
+# histogram buckets per doubling of duration
+BUCKETS_PER_OCTAVE = 4
+
+# per process state, stats are name to histogram
+_profile = {"enabled": False, "stats": {}, "trace": None}
+
+def enable(trace=False):
+    """Start collecting durations in this process, data inherited from the parent process is dropped
+
+    Keyword Arguments:
+        trace {bool} -- keep every call as Chrome trace event as well (default: {False})
+    """
+    _profile["enabled"] = True
+    _profile["stats"] = {}
+    _profile["trace"] = [] if trace else None
+
+def new_histogram():
+    return {"count": 0, "total": 0., "max": 0., "buckets": {}}
+
+def add_duration(histogram, seconds):
+    """Count duration in the log scale bucket
+
+    Arguments:
+        histogram {dict} -- histogram from new_histogram
+        seconds {float} -- duration
+    """
+    bucket = int(math.log2(max(seconds*1e6, 1))*BUCKETS_PER_OCTAVE)
+    histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+    histogram["count"] += 1
+    histogram["total"] += seconds
+    histogram["max"] = max(histogram["max"], seconds)
+
+def merge_histograms(a, b):
+    """Add counts of histogram b to histogram a
+
+    Arguments:
+        a {dict} -- histogram, updated in place
+        b {dict} -- histogram
+    """
+    for bucket, n in b["buckets"].items():
+        a["buckets"][bucket] = a["buckets"].get(bucket, 0) + n
+    a["count"] += b["count"]
+    a["total"] += b["total"]
+    a["max"] = max(a["max"], b["max"])
+
+def percentile(histogram, q):
+    """Estimate percentile from buckets, the upper bound of the bucket is returned
+
+    Arguments:
+        histogram {dict} -- histogram
+        q {float} -- percentile from 0 to 100
+
+    Returns:
+        float -- duration in seconds, None if histogram is empty
+    """
+    if histogram["count"] == 0:
+        return None
+    rank = q/100*histogram["count"]
+    seen = 0
+    for bucket in sorted(histogram["buckets"]):
+        seen += histogram["buckets"][bucket]
+        if seen >= rank:
+            return min(2**((bucket + 1)/BUCKETS_PER_OCTAVE)/1e6, histogram["max"])
+    return histogram["max"]
+
+def record(name, start, end, args=None):
+    histogram = _profile["stats"].get(name)
+    if histogram is None:
+        histogram = _profile["stats"][name] = new_histogram()
+    add_duration(histogram, end - start)
+    if _profile["trace"] is not None:
+        event = {"name": name, "ph": "X", "ts": start*1e6, "dur": (end - start)*1e6, "pid": os.getpid(), "tid": 0}
+        if args is not None:
+            event["args"] = args
+        _profile["trace"].append(event)
+
+@contextmanager
+def span(name, args=None):
+    """Measure duration of the block if profiling is enabled
+
+    Arguments:
+        name {str} -- name of the histogram and the trace event
+
+    Keyword Arguments:
+        args {dict} -- arguments of the trace event (default: {None})
+    """
+    if not _profile["enabled"]:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter(), args)
+
+def timed(name):
+    """Decorator measuring duration of every call if profiling is enabled,
+    a disabled profiler costs one dictionary lookup per call
+
+    Arguments:
+        name {str} -- name of the histogram and the trace event
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profile["enabled"]:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter())
+        return wrapper
+    return decorator
+
+def collect():
+    """Take collected data of this process and start over, to send it to another process
+
+    Returns:
+        dict -- {"stats", "trace"}, None if profiling is not enabled
+    """
+    if not _profile["enabled"]:
+        return None
+    data = {"stats": _profile["stats"], "trace": _profile["trace"]}
+    _profile["stats"] = {}
+    if _profile["trace"] is not None:
+        _profile["trace"] = []
+    return data
+
+def merge(data):
+    """Add data collected in another process
+
+    Arguments:
+        data {dict} -- result of collect, ignored if None
+    """
+    if data is None or not _profile["enabled"]:
+        return
+    for name, histogram in data["stats"].items():
+        merge_histograms(_profile["stats"].setdefault(name, new_histogram()), histogram)
+    if data["trace"] is not None and _profile["trace"] is not None:
+        _profile["trace"] += data["trace"]
+
+def log_summary():
+    """Log count, p50, p95, max and total duration of every measured name"""
+    if not _profile["enabled"]:
+        return
+    logger.info("%-20s %8s %10s %10s %10s %10s"%("name", "count", "p50 ms", "p95 ms", "max ms", "total s"))
+    for name, h in sorted(_profile["stats"].items(), key=lambda x: -x[1]["total"]):
+        logger.info("%-20s %8d %10.2f %10.2f %10.2f %10.2f"%(name, h["count"], percentile(h, 50)*1e3,
+            percentile(h, 95)*1e3, h["max"]*1e3, h["total"]))
+
+def save_trace(filename):
+    """Write trace events in Chrome trace format, to open with chrome://tracing
+
+    Arguments:
+        filename {str} -- path to JSON file
+    """
+    if _profile["trace"] is None:
+        return
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": _profile["trace"], "displayTimeUnit": "ms"}, f)
@@ -7,31 +7,72 @@ __date__ = "05/2019"
 __license__ = "MIT"
 
 import cv2, logging
+import numpy as np
+from collections import OrderedDict
 
-import consts, cv_helpers, text_helpers
+import consts, cv_helpers, text_helpers, profile_helpers
+
+# maximum share of different pixels for a key cell to match a learned key
+KEY_MATCH_TOLERANCE = 0.1
+# minimum difference between the best and the second best learned key
+KEY_MATCH_MARGIN = 0.01
+# largest space kept above and below the table when frames are cropped to it
+TABLE_BAND_MARGIN = 40
+
+key_matcher = text_helpers.KeyMatcher(consts.EXPECTED_KEYS, consts.REPLACE_RULES)
 
 logger = logging.getLogger('')
+
+# per process counts of frames tried and failed with every scaling factor, see pop_attempts
+_attempts = {}
+
+def count_attempt(scaling_factor, failure=None):
+    """Count one recognition try of a frame with the scaling factor
+    
+    Arguments:
+        scaling_factor {int} -- scaling factor
+    
+    Keyword Arguments:
+        failure {str} -- "keys" or "values" if they were not recognized (default: {None})
+    """
+    counts = _attempts.setdefault(scaling_factor, {"tried": 0, "keys": 0, "values": 0})
+    counts["tried"] += 1
+    if failure is not None:
+        counts[failure] += 1
+
+def pop_attempts():
+    """Take counts of this process and start over, to send them to another process
+    
+    Returns:
+        dict -- scaling factor to "tried", "keys" and "values" counts
+    """
+    attempts = dict(_attempts)
+    _attempts.clear()
+    return attempts
+
+def cells_failure(keys, values):
+    if None in keys:
+        return "keys"
+    if None in values:
+        return "values"
+    return None
+
+@profile_helpers.timed("detect_keys")
 def detect_keys(res, expected_keys=consts.EXPECTED_KEYS):
     if len(res) != len(expected_keys):
         return None
+    matcher = key_matcher
+    if expected_keys is not consts.EXPECTED_KEYS:
+        matcher = text_helpers.KeyMatcher(expected_keys, consts.REPLACE_RULES)
     found_keys = []
     for r in res:
-        found = False
-        for k in expected_keys:
-            if k in found_keys:
-                continue
-            val = r
-            if expected_keys[k]["corr"] == consts.CHECK_DISTANCE:
-                val = text_helpers.check_distance(val, k)
-            elif expected_keys[k]["corr"] == consts.CHECK_REPLACE:
-                val = text_helpers.check_replace(val, consts.REPLACE_RULES)
-            if val == k:
-                found_keys.append(val)
-                found = True
-        if len(found_keys) == len(expected_keys) or not found:
+        k = matcher.match(r, found_keys)
+        if k is None:
             break
+        found_keys.append(k)
     return found_keys
 
+@profile_helpers.timed("detect_values")
 def detect_values(res, keys, result, expected_keys=consts.EXPECTED_KEYS):
     if len(res) != len(expected_keys):
         return None
@@ -52,56 +93,489 @@ def detect_values(res, keys, result, expected_keys=consts.EXPECTED_KEYS):
             result[keys[i]] = val
     return result, has_none
 
-def process_one_image(input_path, output_path=None, padding=0, scaling_factor=1, debug=False):
-    original_image = cv2.imread(input_path)
-    processed_image = cv_helpers.preprocess_image(original_image)
+def match_key(text, found_keys, expected_keys=consts.EXPECTED_KEYS):
+    """Find key for text of one key cell with the corrections of detect_keys
+    
+    Arguments:
+        text {str} -- recognized text
+        found_keys {list} -- keys of other cells, they are not matched again
+    
+    Returns:
+        str -- key, None if text does not match any key
+    """
+    matcher = key_matcher
+    if expected_keys is not consts.EXPECTED_KEYS:
+        matcher = text_helpers.KeyMatcher(expected_keys, consts.REPLACE_RULES)
+    return matcher.match(text, found_keys)
+
+def map_value(text, key, expected_keys=consts.EXPECTED_KEYS):
+    """Map text of one value cell with the checks of detect_values
+    
+    Arguments:
+        text {str} -- recognized text
+        key {str} -- key of the value
+    
+    Returns:
+        object -- value, None if text can not be mapped or value is out of range
+    """
+    try:
+        val = expected_keys[key]["map"](text)
+    except (ValueError, OverflowError):
+        logger.warning("Could not map value %s to %s"%(text, key))
+        return None
+    if "range" in expected_keys[key] and not text_helpers.is_val_in_range(val, expected_keys[key]["range"]):
+        logger.warning("Value %s of type %s is out of range"%(text, key))
+        return None
+    return val
+
+def order_scaling_factors(scaling_factor, factor_stats):
+    """Sort scaling factors by share of cells recognized with them before, best first,
+    factors which were not tried keep their order after factors with more than half cells recognized
+    
+    Arguments:
+        scaling_factor {list} -- scaling factors
+        factor_stats {dict} -- scaling factor to (tried cells, recognized cells)
+    
+    Returns:
+        list -- sorted scaling factors
+    """
+    def rate(s):
+        tried, recognised = factor_stats.get(s, (0, 0))
+        return (recognised + 1)/(tried + 2)
+    return sorted(scaling_factor, key=lambda s: -rate(s))
+
+@profile_helpers.timed("check_cells")
+def check_cells(key_texts, value_texts, keys, values):
+    """Find keys and map values of recognized cells
+    
+    Arguments:
+        key_texts {dict} -- row to text of the key cell
+        value_texts {dict} -- row to text of the value cell
+        keys {list} -- key of every row, None if not known, updated in place
+        values {list} -- value of every row, None if not valid, updated in place
+    
+    Returns:
+        int -- number of valid keys and values among the texts
+    """
+    n_recognised = 0
+    for i, text in key_texts.items():
+        keys[i] = match_key(text, keys)
+        n_recognised += keys[i] is not None
+    for i, text in value_texts.items():
+        if keys[i] is not None:
+            values[i] = map_value(text, keys[i])
+            n_recognised += values[i] is not None
+    return n_recognised
+
+def update_factor_stats(factor_stats, scaling_factor, n_tried, n_recognised):
+    if factor_stats is None:
+        return
+    tried, recognised = factor_stats.get(scaling_factor, (0, 0))
+    factor_stats[scaling_factor] = (tried + n_tried, recognised + n_recognised)
+
+def recognise_cells(key_cells, value_cells, keys, values, padding=0, scaling_factor=1, debug=False, batch=False,
+        engine=consts.DEFAULT_OCR_ENGINE, text_cache=None, factor_stats=None, roi_cache=None):
+    """Recognize cells without valid key or value, scaling factors are tried one after another 
+    only for cells which are still not valid
+    
+    Arguments:
+        key_cells {list} -- list of (cv2 image, position) tuples of key cells
+        value_cells {list} -- list of (cv2 image, position) tuples of value cells in the same rows
+        keys {list} -- key of every row, None if not known, updated in place
+        values {list} -- value of every row, None if not valid, updated in place
+    
+    Keyword Arguments:
+        factor_stats {dict} -- scaling factor to (tried cells, recognized cells), updated (default: {None})
+    
+    Returns:
+        bool -- True if all keys and values are valid
+    """
+    for s in scaling_factor:
+        todo_keys = [i for i in range(len(keys)) if keys[i] is None]
+        todo_values = [i for i in range(len(values)) if values[i] is None]
+        if len(todo_keys) + len(todo_values) == 0:
+            return True
+        rois = [key_cells[i] for i in todo_keys] + [value_cells[i] for i in todo_values]
+        texts = [r for r, _ in cv_helpers.recognise_rois(rois, padding, s, debug, batch, engine, 
+            trigger=False, text_cache=text_cache, roi_cache=roi_cache)]
+        n_recognised = check_cells(dict(zip(todo_keys, texts)), dict(zip(todo_values, texts[len(todo_keys):])), 
+            keys, values)
+        update_factor_stats(factor_stats, s, len(rois), n_recognised)
+        count_attempt(s, cells_failure(keys, values))
+        if n_recognised < len(rois):
+            logger.debug("%d of %d cells not recognized with scaling factor [%d]"%(len(rois) - n_recognised, len(rois), s))
+    return None not in keys and None not in values
+
+def new_result(name=None):
+    """Create empty result with None for every expected key
+    
+    Keyword Arguments:
+        name {str} -- value of the "file" field (default: {None})
+    
+    Returns:
+        dict -- result
+    """
+    result = {}
+    for k in consts.EXPECTED_KEYS:
+        result[k] = None
+    result["file"] = name
+    return result
+
+@profile_helpers.timed("match_keys")
+def match_keys(rois, templates):
+    """Identify key cells by comparing them with fingerprints of learned keys, without OCR
+    
+    Arguments:
+        rois {list} -- list of (cv2 image, position) tuples of key cells
+        templates {dict} -- key to cv_helpers.roi_fingerprint
+    
+    Returns:
+        list -- key for every cell, None if any cell does not clearly match one key
+    """
+    keys = []
+    for roi, _ in rois:
+        fingerprint = cv_helpers.roi_fingerprint(roi)
+        diffs = sorted((np.mean(fingerprint != t), k) for k, t in templates.items())
+        if diffs[0][0] > KEY_MATCH_TOLERANCE:
+            return None
+        if len(diffs) > 1 and diffs[1][0] - diffs[0][0] < KEY_MATCH_MARGIN:
+            return None
+        keys.append(diffs[0][1])
+    if len(set(keys)) != len(keys):
+        return None
+    return keys
+
+def learn_table(image, table):
+    """Remember boxes of key and value cells and fingerprints of keys
+    
+    Arguments:
+        image {cv2.image} -- frame image, BGR or grayscale
+        table {dict} -- "keys", "key_boxes" and "value_boxes" of a recognized frame
+    
+    Returns:
+        dict -- table for recognise_values
+    """
+    n = len(table["keys"])
+    boxes = cv_helpers.align_boxes(table["key_boxes"] + table["value_boxes"], image.shape[1])
+    key_boxes = boxes[:n]
+    templates = {}
+    for k, (roi, _) in zip(table["keys"], cv_helpers.crop_rois(image, key_boxes)):
+        templates[k] = cv_helpers.roi_fingerprint(roi)
+    return {
+        "shape": image.shape,
+        "key_boxes": key_boxes,
+        "value_boxes": boxes[n:],
+        "templates": templates
+    }
+
+def recognise_values(image, table, result, padding=0, scaling_factor=1, debug=False, batch=False,
+        engine=consts.DEFAULT_OCR_ENGINE, text_cache=None, factor_stats=None, roi_cache=None):
+    """Recognize only values with keys identified by learned fingerprints,
+    scaling factors are tried one after another until all values are recognized
+    
+    Arguments:
+        image {cv2.image} -- frame image, BGR or grayscale
+        table {dict} -- table from learn_table
+        result {dict} -- result to fill, "file" field is used for logging
+    
+    Keyword Arguments:
+        factor_stats {dict} -- if given, only values which are not valid are recognized with
+            the next scaling factor, see recognise_cells (default: {None})
+    
+    Returns:
+        bool -- True if all keys and values are recognized
+    """
+    name = result["file"]
+    keys = match_keys(cv_helpers.crop_rois(image, table["key_boxes"]), table["templates"])
+    if keys is None:
+        logger.debug("Learned keys do not match [%s]"%name)
+        return False
+    rois = cv_helpers.crop_rois(image, table["value_boxes"])
+    if factor_stats is not None:
+        values = [None]*len(keys)
+        success = recognise_cells([], rois, keys, values, padding, scaling_factor, debug, batch, engine, 
+            text_cache, factor_stats, roi_cache)
+        # values which were recognized are kept even if others are not, as by detect_values
+        for k, v in zip(keys, values):
+            if v is not None:
+                result[k] = v
+        return success
+    for s in scaling_factor:
+        res = cv_helpers.recognise_rois(rois, padding, s, debug, batch, engine, trigger=False, text_cache=text_cache, 
+            roi_cache=roi_cache)
+        values = detect_values([r for r, _ in res], keys, result, consts.EXPECTED_KEYS)
+        if values is None:
+            count_attempt(s, "values")
+            return False
+        if not values[1]:
+            count_attempt(s)
+            return True
+        logger.warning("Some values are None [%s] scaling factor [%d]"%(name, s))
+        count_attempt(s, "values")
+    return False
+
+def detect_layout(image, output_path=None, debug=False, detector=consts.DEFAULT_TEXT_DETECTOR):
+    """Find boxes of text blocks on the image
+    
+    Arguments:
+        image {cv2.image} -- original image
+    
+    Keyword Arguments:
+        output_path {str} -- prefix for debug images (default: {None})
+        debug {bool} -- enable debug output (default: {False})
+        detector {str} -- text detector name, key of cv_helpers.TEXT_DETECTORS (default: {consts.DEFAULT_TEXT_DETECTOR})
+    
+    Returns:
+        list -- list of (x, y, w, h) tuples from top to bottom
+    """
+    if detector != "contours":
+        return cv_helpers.get_text_detector(detector).detect(image)
+    processed_image = cv_helpers.preprocess_image(image)
     if debug and output_path is not None:
         cv2.imwrite(output_path + "_processed.png", processed_image)
     cntrs = cv_helpers.find_countours(processed_image)
-    output_image = cv_helpers.draw_countrous(original_image, cntrs)
     if debug and output_path is not None:
-        cv2.imwrite(output_path + "_output.png", output_image)
-    rois = cv_helpers.get_rois(original_image, cntrs)
+        cv2.imwrite(output_path + "_output.png", cv_helpers.draw_countrous(image, cntrs))
+    return cv_helpers.get_boxes(cntrs)
 
-    original_width = original_image.shape[:2][1]
+def learn_band(image, boxes, table):
+    """Find rows of the frame with the table, from the middle of the space above the first row
+    to the same distance below the last row, at most TABLE_BAND_MARGIN
+    
+    Arguments:
+        image {cv2.image} -- frame image, BGR or grayscale
+        boxes {list} -- list of (x, y, w, h) tuples of all text blocks of the frame
+        table {dict} -- "key_boxes" and "value_boxes" of a recognized frame
+    
+    Returns:
+        dict -- "shape", "top" and "bottom" row of the band
+    """
+    table_boxes = table["key_boxes"] + table["value_boxes"]
+    top = min(b[1] for b in table_boxes)
+    bottom = max(b[1] + b[3] for b in table_boxes)
+    above = [b[1] + b[3] for b in boxes if b[1] + b[3] <= top]
+    margin = TABLE_BAND_MARGIN if len(above) == 0 else min(TABLE_BAND_MARGIN, (top - max(above))//2)
+    return {
+        "shape": image.shape,
+        "top": max(0, top - margin),
+        "bottom": min(image.shape[0], bottom + margin)
+    }
 
-    result = {}
-    for k in consts.EXPECTED_KEYS:
-        result[k] = None
-    result["file"] = input_path
+def detect_band_layout(image, band, output_path=None, debug=False, detector=consts.DEFAULT_TEXT_DETECTOR):
+    """Find boxes of text blocks in the band of the table only
+    
+    Arguments:
+        image {cv2.image} -- original image
+        band {dict} -- band from learn_band
+    
+    Keyword Arguments:
+        output_path {str} -- prefix for debug images (default: {None})
+        debug {bool} -- enable debug output (default: {False})
+        detector {str} -- text detector name, key of cv_helpers.TEXT_DETECTORS (default: {consts.DEFAULT_TEXT_DETECTOR})
+    
+    Returns:
+        list -- list of (x, y, w, h) tuples in coordinates of the frame from top to bottom
+    """
+    boxes = detect_layout(image[band["top"]:band["bottom"]], output_path, debug, detector)
+    return [(x, y + band["top"], w, h) for x, y, w, h in boxes]
+
+def recognise_layout(image, boxes, result, padding=0, scaling_factor=1, debug=False, batch=False,
+        engine=consts.DEFAULT_OCR_ENGINE, text_cache=None, factor_stats=None, roi_cache=None, trigger=True):
+    """Recognize keys and values in boxes, scaling factors are tried one after another
+    until all keys and values are recognized
+    
+    Arguments:
+        image {cv2.image} -- frame image, BGR or grayscale
+        boxes {list} -- list of (x, y, w, h) tuples from top to bottom
+        result {dict} -- result to fill, "file" field is used for logging
+    
+    Keyword Arguments:
+        factor_stats {dict} -- if given, once a scaling factor finds all cells only cells 
+            which are not valid are recognized with the next scaling factor, see recognise_cells (default: {None})
+        trigger {bool} -- skip boxes until TRIGGER_WORD is found, boxes start with the table otherwise (default: {True})
+    
+    Returns:
+        (bool, dict) -- (True if all keys and values are recognized, 
+            "keys", "key_boxes" and "value_boxes" of the recognized table)
+    """
+    rois = cv_helpers.crop_rois(image, boxes)
+    original_width = image.shape[:2][1]
+    name = result["file"]
 
-    first_key = list(consts.EXPECTED_KEYS.keys())[0]
+    keys = values = None
+    table = None
     # sometimes things work with different scaling of the word
     for i in range(len(scaling_factor)):
         s = scaling_factor[i]
-        res = cv_helpers.recognise_rois(rois, padding, s, debug)
+        res = cv_helpers.recognise_rois(rois, padding, s, debug, batch, engine, trigger, text_cache, roi_cache)
 
         potential_keys = []
         potential_values = []
+        key_boxes = []
+        value_boxes = []
         # get keys from the left half and values from the right
         for r,p in res:
             if p[2] < original_width/4:
                 potential_keys.append(r)
+                key_boxes.append((p[2], p[0], p[3] - p[2], p[1] - p[0]))
             if p[3] > original_width/2:
                 potential_values.append(r)
+                value_boxes.append((p[2], p[0], p[3] - p[2], p[1] - p[0]))
 
         if len(res)%2 != 0:
-            logger.warning("Cannot process - odd number of values [%s] scaling factor [%d]"%(input_path, s))
+            logger.warning("Cannot process - odd number of values [%s] scaling factor [%d]"%(name, s))
+            count_attempt(s, "keys")
+            update_factor_stats(factor_stats, s, len(res), 0)
             continue
+        if factor_stats is not None:
+            n = len(consts.EXPECTED_KEYS)
+            if len(key_boxes) != n or len(value_boxes) != n:
+                logger.warning("Keys not found [%s] scaling factor [%d]"%(name, s))
+                count_attempt(s, "keys")
+                update_factor_stats(factor_stats, s, len(res), 0)
+                continue
+            keys = [None]*n
+            values = [None]*n
+            n_recognised = check_cells(dict(enumerate(potential_keys)), dict(enumerate(potential_values)), keys, values)
+            update_factor_stats(factor_stats, s, len(res), n_recognised)
+            count_attempt(s, cells_failure(keys, values))
+            cells = dict((p, r) for r, p in rois)
+            key_cells = [(cells[p], p) for _, p in res if p[2] < original_width/4]
+            value_cells = [(cells[p], p) for _, p in res if p[3] > original_width/2]
+            success = recognise_cells(key_cells, value_cells, keys, values, padding, scaling_factor[i+1:], debug, batch, 
+                engine, text_cache, factor_stats, roi_cache)
+            # values which were recognized are kept even if others are not, as by detect_values
+            for k, v in zip(keys, values):
+                if k is not None and v is not None and result[k] is None:
+                    result[k] = v
+            if success:
+                table = {"keys": keys, "key_boxes": key_boxes, "value_boxes": value_boxes}
+            else:
+                logger.warning("Keys or values not found [%s] scaling factors %s"%(name, scaling_factor[i:]))
+            break
         keys = detect_keys(potential_keys)
         if keys is None or len(keys) != len(consts.EXPECTED_KEYS):
-            logger.warning("Keys not found [%s] scaling factor [%d]"%(input_path, s))
+            logger.warning("Keys not found [%s] scaling factor [%d]"%(name, s))
+            count_attempt(s, "keys")
             continue
         values, has_none = detect_values(potential_values, keys, result, consts.EXPECTED_KEYS)
         if values is None:
-            logger.warning("Values not found [%s] scaling factor [%d]"%(input_path, s))
+            logger.warning("Values not found [%s] scaling factor [%d]"%(name, s))
+            count_attempt(s, "values")
             continue
         if has_none:
-            logger.warning("Some values are None [%s] scaling factor [%d]"%(input_path, s))
+            logger.warning("Some values are None [%s] scaling factor [%d]"%(name, s))
+            count_attempt(s, "values")
             continue
+        count_attempt(s)
+        table = {"keys": keys, "key_boxes": key_boxes, "value_boxes": value_boxes}
         break
     logger.debug(keys)
     logger.debug(values)
+    return table is not None, table
+
+def process_one_image(input_path, output_path=None, padding=0, scaling_factor=1, debug=False, name=None, batch=False,
+        engine=consts.DEFAULT_OCR_ENGINE, cache=None, reuse_layout=False, reuse_keys=False,
+        reuse_texts=False, adaptive=False, crop_table=False, detector=consts.DEFAULT_TEXT_DETECTOR, layout_boxes=None):
+    """Recognize keys and values on one frame
+    
+    Arguments:
+        input_path {str or cv2.image} -- path to image file or already decoded image
+    
+    Keyword Arguments:
+        output_path {str} -- prefix for debug images (default: {None})
+        padding {int} -- padding for every ROI (default: {0})
+        scaling_factor {list} -- scaling factors to try one after another (default: {1})
+        debug {bool} -- enable debug output (default: {False})
+        name {str} -- value of the "file" field, input_path if None (default: {None})
+        batch {bool} -- recognize all ROIs of a scaling factor with one Tesseract call (default: {False})
+        engine {str} -- OCR engine name, key of cv_helpers.OCR_ENGINES (default: {consts.DEFAULT_OCR_ENGINE})
+        cache {dict} -- state shared by frames of one recording (default: {None})
+        reuse_layout {bool} -- reuse boxes of text blocks from the cache, detect them again
+            only if recognition fails (default: {False})
+        reuse_keys {bool} -- identify keys by fingerprints learned from previous frames 
+            and recognize only values, full recognition is used if it fails (default: {False})
+        reuse_texts {bool} -- reuse text of ROIs which look like ROIs recognized before (default: {False})
+        adaptive {bool} -- try scaling factors which recognized most cells of previous frames first
+            and recognize with the next factor only cells which are not valid (default: {False})
+        crop_table {bool} -- detect text blocks only in rows of the table found on previous frames 
+            and skip blocks above it, the whole frame is used if it fails (default: {False})
+        detector {str} -- text detector name, key of cv_helpers.TEXT_DETECTORS (default: {consts.DEFAULT_TEXT_DETECTOR})
+        layout_boxes {list} -- boxes of text blocks of the frame detected beforehand, e.g. together with
+            other frames, used instead of detecting them (default: {None})
+    
+    Returns:
+        (bool, bool, dict) -- (has value, has None value, result)
+    """
+    if isinstance(input_path, str):
+        original_image = cv2.imread(input_path)
+        name = input_path if name is None else name
+    else:
+        original_image = input_path
+    options = {"padding": padding, "scaling_factor": scaling_factor, "debug": debug, "batch": batch, "engine": engine}
+    reuse_layout = reuse_layout and cache is not None
+    reuse_keys = reuse_keys and cache is not None
+    crop_table = crop_table and cache is not None
+    if reuse_texts and cache is not None:
+        options["text_cache"] = cache.setdefault("texts", OrderedDict())
+    if adaptive:
+        options["factor_stats"] = {} if cache is None else cache.setdefault("factors", {})
+        options["scaling_factor"] = order_scaling_factors(scaling_factor, options["factor_stats"])
+
+    # ROIs are cropped from the grayscale frame, so colors are converted once per frame
+    image = cv_helpers.to_gray(original_image)
+    options["roi_cache"] = {}
+
+    result = new_result(name)
+    success = False
+    table = None
+    learned = cache.get("table") if reuse_keys else None
+    # image of another size can not have the same layout
+    if learned is not None and learned["shape"] == image.shape:
+        success = recognise_values(image, learned, result, **options)
+        if not success:
+            logger.debug("Learned keys failed [%s], recognizing keys again"%name)
+            result = new_result(name)
+    band = cache.get("band") if crop_table else None
+    if band is not None and band["shape"] != image.shape:
+        band = None
+    layout = cache.get("layout") if reuse_layout and not success else None
+    if layout is not None and layout["shape"] == image.shape:
+        boxes = layout["boxes"]
+        if band is not None:
+            boxes = [b for b in boxes if b[1] >= band["top"]]
+        success, table = recognise_layout(image, boxes, result, trigger=band is None, **options)
+        if not success:
+            logger.debug("Cached layout does not fit [%s], detecting again"%name)
+            result = new_result(name)
+    if band is not None and not success:
+        if layout_boxes is not None:
+            boxes = [b for b in layout_boxes if b[1] >= band["top"] and b[1] + b[3] <= band["bottom"]]
+        else:
+            boxes = detect_band_layout(original_image, band, output_path, debug, detector)
+        success, table = recognise_layout(image, boxes, result, trigger=False, **options)
+        if success and reuse_layout:
+            cache["layout"] = {
+                "shape": image.shape,
+                "boxes": cv_helpers.align_boxes(boxes, image.shape[1])
+            }
+        if not success:
+            logger.debug("Table band does not fit [%s], detecting in the whole frame"%name)
+            result = new_result(name)
+    if not success:
+        boxes = layout_boxes
+        if boxes is None:
+            boxes = detect_layout(original_image, output_path, debug, detector)
+        success, table = recognise_layout(image, boxes, result, **options)
+        if success and reuse_layout:
+            cache["layout"] = {
+                "shape": image.shape,
+                "boxes": cv_helpers.align_boxes(boxes, image.shape[1])
+            }
+        if success and crop_table:
+            cache["band"] = learn_band(image, boxes, table)
+    if table is not None and reuse_keys:
+        cache["table"] = learn_table(image, table)
     
     has_none = False
     has_value = False
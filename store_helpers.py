@@ -0,0 +1,99 @@
+__author__ = "Igor Kim"
+__credits__ = ["Igor Kim"]
+__maintainer__ = "Igor Kim"
+__email__ = "igor.skh@gmail.com"
+__status__ = "Development"
+__date__ = "05/2019"
+__license__ = "MIT"
+
+import json, pickle, sqlite3, hashlib, logging
+
+logger = logging.getLogger('')
+
+# number of new results written to the file at once
+COMMIT_INTERVAL = 50
+
+def file_hash(path):
+    """Hash of the file content
+
+    Arguments:
+        path {str} -- path to file
+
+    Returns:
+        str -- hex digest
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def image_hash(image):
+    """Hash of the decoded image
+
+    Arguments:
+        image {cv2.image} -- image
+
+    Returns:
+        str -- hex digest
+    """
+    h = hashlib.sha1(str(image.shape).encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+class ResultStore:
+    """Results of recognized frames in a SQLite file, a result is found by
+    frame name, content hash and recognition parameters, so changed frames
+    and runs with other parameters are recognized again
+    """
+    def __init__(self, path, params):
+        """Open or create the store
+
+        Arguments:
+            path {str} -- path to SQLite file
+            params {dict} -- recognition parameters, must be JSON serializable
+        """
+        self.path = path
+        self.params = params
+        self._params_key = json.dumps(params, sort_keys=True)
+        self._n_pending = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (name TEXT, hash TEXT, params TEXT, result BLOB, "
+            "PRIMARY KEY (name, hash, params))")
+        self._conn.commit()
+
+    def get(self, name, content_hash):
+        """Find stored result
+
+        Arguments:
+            name {str} -- frame name
+            content_hash {str} -- hash of the frame
+
+        Returns:
+            dict -- result, None if not stored
+        """
+        row = self._conn.execute("SELECT result FROM results WHERE name=? AND hash=? AND params=?",
+            (name, content_hash, self._params_key)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, name, content_hash, result):
+        """Store result, it is written to the file with every COMMIT_INTERVAL result or on close
+
+        Arguments:
+            name {str} -- frame name
+            content_hash {str} -- hash of the frame
+            result {dict} -- result
+        """
+        self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            (name, content_hash, self._params_key, pickle.dumps(result)))
+        self._n_pending += 1
+        if self._n_pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._n_pending = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -1,6 +1,7 @@
-import unittest
+import unittest, tempfile, os, datetime
 
 import text_helpers
+import store_helpers
 
 class TestTextHelpersMethods(unittest.TestCase):
     def test_distance(self):
@@ -61,5 +62,194 @@ class TestTextHelpersMethods(unittest.TestCase):
             res = text_helpers.check_replace(t[0], REPLACE_RULES)
             self.assertEqual(res, t[-1])
 
+    def test_bounded_distance(self):
+        test_cases = [
+            ("test_string", "test string", 3, 1),
+            ("test_strings", "teststring", 3, 2),
+            ("test_strings", "teststring", 1, 2),
+            ("test_string", "test_string", 0, 0),
+            ("phy_cell_id", "timestamp", 3, 4),
+            ("", "abc", 2, 3)
+        ]
+        for t in test_cases:
+            res = text_helpers.bounded_edit_distance(t[0], t[1], t[2])
+            self.assertEqual(res, t[-1])
+
+    def test_key_matcher(self):
+        expected_keys = {
+            "phy_cell_id": {"corr": 2},
+            "timestamp": {"corr": 2},
+            "rsrq0": {"corr": 1},
+            "sinr1": {"corr": 1}
+        }
+        matcher = text_helpers.KeyMatcher(expected_keys, {"1,-1": ["l"], "0,-1": ["o"]})
+        test_cases = [
+            ("phy_cell_id", (), "phy_cell_id"),
+            ("phy cel1 id", (), "phy_cell_id"),
+            ("timestarnp", (), "timestamp"),
+            ("rSrqO", (), "rsrq0"),
+            ("sinrl", (), "sinr1"),
+            ("sinrl", ("sinr1",), None),
+            ("phy_cell_id", ("phy_cell_id",), None),
+            ("value", (), None)
+        ]
+        for t in test_cases:
+            res = matcher.match(t[0], t[1])
+            self.assertEqual(res, t[-1])
+
+class TestResultStore(unittest.TestCase):
+    def test_result_key(self):
+        params = {"padding": 20, "scaling_factor": [5, 4], "engine": "pytesseract"}
+        result = {"file": "frame0.png", "timestamp": datetime.datetime(2019, 5, 1, 12, 0), "rsrp0": -90}
+        with tempfile.TemporaryDirectory() as folder:
+            frame_path = os.path.join(folder, "frame0.png")
+            with open(frame_path, "wb") as f:
+                f.write(b"frame")
+            content_hash = store_helpers.file_hash(frame_path)
+            store_path = os.path.join(folder, "results.db")
+            store = store_helpers.ResultStore(store_path, params)
+            store.put("frame0.png", content_hash, result)
+            store.close()
+            test_cases = [
+                (params, "frame0.png", result),
+                (dict(params, padding=10), "frame0.png", None),
+                (dict(params, engine="tesserocr"), "frame0.png", None),
+                (params, "frame1.png", None)
+            ]
+            for t in test_cases:
+                store = store_helpers.ResultStore(store_path, t[0])
+                self.assertEqual(store.get(t[1], content_hash), t[-1])
+                store.close()
+            with open(frame_path, "wb") as f:
+                f.write(b"changed frame")
+            store = store_helpers.ResultStore(store_path, params)
+            self.assertIsNone(store.get("frame0.png", store_helpers.file_hash(frame_path)))
+            store.close()
+
+class TestOutputWriters(unittest.TestCase):
+    base = datetime.datetime(2019, 5, 1, 12, 0)
+
+    def new_result(self, seconds, **values):
+        import consts
+        result = dict((k, None) for k in consts.EXPECTED_KEYS)
+        result["file"] = "frame%d.png"%seconds
+        result["timestamp"] = self.base + datetime.timedelta(seconds=seconds)
+        result.update(values)
+        return result
+
+    def read_parquet(self, path):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        return pq.read_table(path)
+
+    def test_arrow_writer(self):
+        import consts, output_helpers
+        from dateutil import parser
+        results = [
+            self.new_result(3, rsrp0=-93),
+            self.new_result(1, rsrp0=-91),
+            self.new_result(3, rsrp0=-99, rsrp1=-83),
+            self.new_result(2, sinr0=2.5),
+            # 4 timestamps are pending, 0 and 1 are written
+            self.new_result(0, phy_cell_id=100),
+            self.new_result(1, rsrp0=-80),
+            self.new_result(5),
+            # 2 and 3 are written
+            self.new_result(4),
+            # older than written rows, the file is sorted on close
+            self.new_result(-1),
+            dict(self.new_result(6), timestamp=parser.parse("2019-05-01 14:00:06+02:00"))
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "out.parquet")
+            try:
+                writer = output_helpers.ArrowWriter(path, batch_size=2)
+            except ImportError:
+                self.skipTest("pyarrow is not installed")
+            for r in results:
+                writer.write(r)
+            writer.close()
+            self.assertEqual(writer.n_dropped, 1)
+            table = self.read_parquet(path)
+            pa = writer.pa
+        for k, v in consts.EXPECTED_KEYS.items():
+            self.assertEqual(table.schema.field(k).type, output_helpers.arrow_type(pa, v["dtype"]))
+        self.assertEqual(table.schema.field("timestamp").type, pa.timestamp("us", tz="UTC"))
+        utc = datetime.timezone.utc
+        self.assertEqual(table.column("timestamp").to_pylist(),
+            [self.base.replace(tzinfo=utc) + datetime.timedelta(seconds=i) for i in range(-1, 7)])
+        rows = dict((r["file"], r) for r in table.to_pylist())
+        self.assertEqual(len(rows), 8)
+        self.assertEqual((rows["frame3.png"]["rsrp0"], rows["frame3.png"]["rsrp1"]), (-93, -83))
+        self.assertEqual(rows["frame1.png"]["rsrp0"], -91)
+        self.assertEqual(rows["frame0.png"]["phy_cell_id"], 100)
+        self.assertEqual(rows["frame2.png"]["sinr0"], 2.5)
+
+    def test_csv_and_arrow_output(self):
+        import output_helpers
+        import pandas as pd
+        results = [
+            self.new_result(0, rsrp0=-90),
+            self.new_result(0, rsrp0=-95, sinr0=1.5),
+            self.new_result(1, phy_cell_id=7),
+            self.new_result(2, rsrq0=-10),
+            self.new_result(2, rsrq1=-11),
+            self.new_result(3, sinr1=-2.5)
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "out.csv")
+            parquet_path = os.path.join(folder, "out.parquet")
+            csv_writer = output_helpers.CsvWriter(csv_path)
+            try:
+                arrow_writer = output_helpers.ArrowWriter(parquet_path, batch_size=2)
+            except ImportError:
+                self.skipTest("pyarrow is not installed")
+            for r in results:
+                csv_writer.write(r)
+                arrow_writer.write(r)
+            csv_writer.close()
+            arrow_writer.close()
+            columns = list(results[0])
+            csv_df = pd.read_csv(csv_path, index_col=0, parse_dates=["timestamp"])[columns]
+            arrow_df = self.read_parquet(parquet_path).to_pandas()[columns]
+        arrow_df["timestamp"] = arrow_df["timestamp"].dt.tz_localize(None)
+        pd.testing.assert_frame_equal(csv_df, arrow_df, check_dtype=False)
+
+# video modules are imported by their tests, so tests of other modules run without the OpenCV stack
+class TestVideoSegments(unittest.TestCase):
+    def test_split_video_segments(self):
+        import cv_helpers
+        frames = list(range(0, 100, 5))
+        test_cases = [
+            (1, None, [(0, 20)]),
+            (2, None, [(0, 10), (10, 20)]),
+            (2, [0, 42], [(0, 9), (9, 20)]),
+            (3, [0, 60], [(0, 12), (12, 20)]),
+            (4, [0], [(0, 20)]),
+            (2, [0, 99], [(0, 20)])
+        ]
+        for t in test_cases:
+            res = cv_helpers.split_video_segments(frames, t[0], t[1])
+            self.assertEqual(res, t[-1])
+
+    def test_join_segments(self):
+        import numpy as np
+        import mp_helpers
+        results = [
+            (0, [0, 10, 20], 40, {30: np.zeros((2, 2, 3), np.uint8)}),
+            (25, [25, 40, 45], 60, {}),
+            (50, [50, 60, 70], None, {})
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            for _, kept, _, _ in results:
+                for f in kept:
+                    open("%s/frame%d.png"%(folder, f), "w").close()
+            res = mp_helpers.join_segments(results, 100, folder)
+            expected = [0, 10, 20, 30, 40, 45, 60, 70]
+            self.assertEqual(res, ["%s/frame%d.png"%(folder, f) for f in expected])
+            self.assertEqual(sorted(os.listdir(folder)), sorted("frame%d.png"%f for f in expected))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
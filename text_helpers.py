@@ -6,6 +6,8 @@ __status__ = "Development"
 __date__ = "05/2019"
 __license__ = "MIT"
 
+import consts
+
 def minimum_edit_distance(s1,s2):
     """Calculates Levenshtein distance for strings s1 and s2
     Source: https://rosettacode.org/wiki/Levenshtein_distance#Python
@@ -32,6 +34,47 @@ def minimum_edit_distance(s1,s2):
         distances = newDistances
     return distances[-1]
 
+def bounded_edit_distance(s1, s2, threshold):
+    """Calculates Levenshtein distance for strings s1 and s2 only if it is not above the threshold,
+    only the band of 2*threshold+1 cells around the diagonal is computed (Ukkonen)
+    and computation stops as soon as a whole row is above the threshold
+    
+    Arguments:
+        s1 {str} -- string 1
+        s2 {str} -- string 2
+        threshold {int} -- maximum distance of interest
+    
+    Returns:
+        int -- distance, threshold+1 if the distance is above the threshold
+    """
+    above = threshold + 1
+    if abs(len(s1) - len(s2)) > threshold:
+        return above
+    if len(s1) > len(s2):
+        s1,s2 = s2,s1
+    n = len(s1)
+    distances = [i if i <= threshold else above for i in range(n + 1)]
+    new_distances = [above]*(n + 1)
+    for index2,char2 in enumerate(s2, 1):
+        new_distances[0] = index2 if index2 <= threshold else above
+        row_min = new_distances[0]
+        first = max(1, index2 - threshold)
+        last = min(n, index2 + threshold)
+        if first > 1:
+            new_distances[first - 1] = above
+        for index1 in range(first, last + 1):
+            d = distances[index1 - 1] + (s1[index1 - 1] != char2)
+            d = min(d, distances[index1] + 1, new_distances[index1 - 1] + 1, above)
+            new_distances[index1] = d
+            if d < row_min:
+                row_min = d
+        if last < n:
+            new_distances[last + 1] = above
+        if row_min > threshold:
+            return above
+        distances, new_distances = new_distances, distances
+    return distances[n]
+
 def is_val_in_range(val, range):
     """Checks if val falls in range
     
@@ -58,7 +101,43 @@ def check_distance(val, val_expected, threshold=3):
     Returns:
         str -- string 1 if distance above the threshold, string 2 otherwise
     """
-    return val_expected if minimum_edit_distance(val, val_expected)<=threshold else val
+    return val_expected if bounded_edit_distance(val, val_expected, threshold)<=threshold else val
+
+def compile_replace_rules(replace_rules):
+    """Parse keys of replace rules once
+    
+    Arguments:
+        replace_rules {dict} -- rules to replace, see check_replace
+    
+    Returns:
+        list -- list of (replace to, position or None, list of replace from) tuples
+    """
+    rules = []
+    for replace_to in replace_rules:
+        to, position = replace_to.split(",")
+        rules.append((to, int(position) if len(position) > 0 else None, replace_rules[replace_to]))
+    return rules
+
+def apply_replace_rules(val, rules):
+    """Replaces string in val by rules from compile_replace_rules
+    
+    Arguments:
+        val {str} -- input string
+        rules {list} -- compiled rules
+    
+    Returns:
+        str -- output string with replacements
+    """
+    val = str(val).lower()
+    for to, position, replace_from in rules:
+        for f in replace_from:
+            if position is None:
+                val = val.replace(f, to)
+            elif position < 0:
+                val = val[:position] + val[position:].replace(f, to)
+            else:
+                val = val[:position].replace(f, to) + val[position:]
+    return val
 
 def check_replace(val, replace_rules):
     """Replaces string in val by rules in dictionary replace_rules
@@ -75,19 +154,59 @@ def check_replace(val, replace_rules):
     Returns:
         str -- output string with replacements
     """
-    val = str(val).lower()
-    for replace_to in replace_rules:
-        replace_to_ = replace_to.split(",")
-        if len(replace_to_[1]) == 0:
-            replace_to_[1] = None
-        else:
-            replace_to_[1] = int(replace_to_[1])
-        for replace_from in replace_rules[replace_to]:
-            if replace_to_[1] is None:
-                val = val.replace(replace_from, replace_to_[0])
+    return apply_replace_rules(val, compile_replace_rules(replace_rules))
+
+class KeyMatcher:
+    """Finds expected key for recognized text with corrections of every key,
+    keys and replace rules are prepared once and reused for every text
+    """
+    def __init__(self, expected_keys, replace_rules, threshold=3):
+        """Prepare keys
+        
+        Arguments:
+            expected_keys {dict} -- key to description with "corr" check type, see consts.EXPECTED_KEYS
+            replace_rules {dict} -- rules to replace for consts.CHECK_REPLACE keys, see check_replace
+        
+        Keyword Arguments:
+            threshold {int} -- maximum distance for consts.CHECK_DISTANCE keys (default: {3})
+        """
+        self.threshold = threshold
+        self._keys = [(k, expected_keys[k]["corr"]) for k in expected_keys]
+        # keys found by text equal to them, without replacements
+        self._exact = set(k for k, corr in self._keys if corr != consts.CHECK_REPLACE)
+        self._rules = compile_replace_rules(replace_rules)
+
+    def match(self, val, exclude=()):
+        """Find the key closest to val, ties are resolved by order of expected keys
+        
+        Arguments:
+            val {str} -- recognized text
+        
+        Keyword Arguments:
+            exclude {list} -- keys which are not matched, e.g. already found (default: {()})
+        
+        Returns:
+            str -- key, None if val does not match any key
+        """
+        if val in self._exact and val not in exclude:
+            return val
+        best = None
+        best_distance = self.threshold + 1
+        replaced = None
+        for k, corr in self._keys:
+            if k in exclude:
                 continue
-            if replace_to_[1] < 0:
-                val = val[:replace_to_[1]] + val[replace_to_[1]:].replace(replace_from, replace_to_[0])
+            if corr == consts.CHECK_DISTANCE:
+                # only a strictly closer key can be the new best
+                d = bounded_edit_distance(val, k, best_distance - 1)
+            elif corr == consts.CHECK_REPLACE:
+                if replaced is None:
+                    replaced = apply_replace_rules(val, self._rules)
+                d = 0 if replaced == k else best_distance
             else:
-                val = val[:replace_to_[1]].replace(replace_from, replace_to_[0]) + val[replace_to_[1]:]
-    return val
\ No newline at end of file
+                d = 0 if val == k else best_distance
+            if d < best_distance:
+                best, best_distance = k, d
+                if d == 0:
+                    break
+        return best
\ No newline at end of file